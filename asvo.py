@@ -1,7 +1,10 @@
+import os
 import xml.etree.ElementTree as ET
+import numpy as np
 from matplotlib import pyplot as plt
 from collections import defaultdict
 from statistics import mode
+from basics import atomic_save
 
 plt.rcParams.update({'font.size': 20})
 
@@ -30,6 +33,66 @@ def parse_asvo_results_xml(filename):
     return results
 
 
+def _local_tag(tag):
+    # strip the XML namespace, e.g. "{http://www.ivoa.net/xml/VOTable/v1.3}TD" -> "TD"
+    return tag.rsplit("}", 1)[-1]
+
+
+def _typed_column(values, datatype):
+    # Build a NumPy column from the TD strings, using the FIELD datatype.
+    # Integers with missing values become floats with NaN, missing bits become False
+    # and missing strings become "".
+    if datatype in ("long", "int", "short", "unsignedByte"):
+        if None not in values:
+            return np.array(values, dtype=np.int64)
+        return np.array([np.nan if v is None else v for v in values], dtype=np.float64)
+    if datatype in ("float", "double"):
+        return np.array([np.nan if v is None else v for v in values], dtype=np.float64)
+    if datatype in ("bit", "boolean"):
+        return np.array([v is not None and v.strip().lower() in ("1", "t", "true") for v in values], dtype=bool)
+    return np.array(["" if v is None else v for v in values], dtype=str)
+
+
+def _iterparse_asvo_columns(filename):
+    fields, columns, row = [], [], []
+    for event, elem in ET.iterparse(filename, events=("end",)):
+        tag = _local_tag(elem.tag)
+        if tag == "FIELD":
+            fields.append((elem.attrib["name"], elem.attrib.get("datatype", "char")))
+            columns.append([])
+        elif tag == "TD":
+            row.append(elem.text)
+        elif tag == "TR":
+            for column, value in zip(columns, row):
+                column.append(value)
+            row = []
+            # rows are not needed once their values are stored
+            elem.clear()
+    return {name: _typed_column(values, datatype) for (name, datatype), values in zip(fields, columns)}
+
+
+def load_asvo_columns(filename, use_cache = True):
+    """
+    Columnar version of parse_asvo_results_xml: returns a dict mapping every FIELD name to
+    a NumPy array typed according to the FIELD datatype. The XML is parsed incrementally;
+    the columns are cached in `<filename>.npz`, which is rebuilt when the XML is newer.
+    """
+    cache_filename = filename + ".npz"
+    if use_cache and os.path.exists(cache_filename) and os.path.getmtime(cache_filename) >= os.path.getmtime(filename):
+        with np.load(cache_filename) as cache:
+            return {name: cache[name] for name in cache.files}
+    columns = _iterparse_asvo_columns(filename)
+    if use_cache:
+        atomic_save(cache_filename, lambda f: np.savez(f, **columns))
+    return columns
+
+
+def columns_to_records(columns):
+    # list of dicts, one per row, as returned by parse_asvo_results_xml
+    names = list(columns.keys())
+    return [dict(zip(names, row)) for row in zip(*(columns[n].tolist() for n in names))]
+
+
 def print_general_stats(obs):
     #no_cal_obs 
     print(len(obs))
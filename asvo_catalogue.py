@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+
+# In-memory columnar catalogue of ASVO observations. The VOTable exports are loaded once
+# into NumPy columns (see asvo.load_asvo_columns) and the reports of asvo.py and
+# parse_asvo.py are computed with vectorised filters and group-by aggregations instead of
+# one Python scan over a list of dicts per report.
+
+import argparse
+import numpy as np
+from asvo import load_asvo_columns
+
+
+class ObservationCatalogue:
+
+    def __init__(self, columns):
+        self.columns = columns
+        self.n_obs = len(next(iter(columns.values()))) if columns else 0
+
+    @classmethod
+    def from_files(cls, filenames, use_cache = True):
+        # Columns present in all the files, concatenated (NumPy promotes the dtypes).
+        loaded = [load_asvo_columns(f, use_cache) for f in filenames]
+        names = [n for n in loaded[0] if all(n in c for c in loaded[1:])]
+        return cls({n: np.concatenate([c[n] for c in loaded]) for n in names})
+
+    def __len__(self):
+        return self.n_obs
+
+    def __getitem__(self, name):
+        if name == "year" and "year" not in self.columns:
+            # derived from "YYYY-MM-DDThh:mm:ss..." strings
+            self.columns["year"] = self.columns["starttime_utc"].astype("U4").astype(np.int64)
+        return self.columns[name]
+
+    def filter(self, mask = None, **equal_to):
+        """
+        Sub-catalogue of the rows where `mask` is True and every given column equals the
+        given value, e.g. catalogue.filter(catalogue["duration"] >= 1200, projectid="G0024").
+        """
+        keep = np.ones(self.n_obs, dtype=bool) if mask is None else np.asarray(mask, dtype=bool).copy()
+        for name, value in equal_to.items():
+            keep &= self[name] == value
+        return ObservationCatalogue({name: column[keep] for name, column in self.columns.items()})
+
+    def group_codes(self, keys):
+        """
+        Group the rows by the columns in `keys`. Returns the unique key values (one array
+        per key, sorted lexicographically) and the group index of every row.
+        """
+        uniques, codes = [], []
+        for key in keys:
+            unique, code = np.unique(self[key], return_inverse=True)
+            uniques.append(unique)
+            codes.append(code.ravel())
+        if not keys:
+            return [], np.zeros(self.n_obs, dtype=np.int64)
+        combined = np.ravel_multi_index(codes, [len(u) for u in uniques])
+        groups, inverse = np.unique(combined, return_inverse=True)
+        group_keys = [u[c] for u, c in zip(uniques, np.unravel_index(groups, [len(u) for u in uniques]))]
+        return group_keys, inverse.ravel()
+
+    def aggregate(self, keys, value = None, func = "count"):
+        """
+        Dict mapping every group of `keys` (a tuple of values, or the value itself for a
+        single key) to the count of its rows or the sum/mean/min/max of column `value`.
+        Groups are in sorted order.
+        """
+        if isinstance(keys, str):
+            keys = [keys]
+        group_keys, inverse = self.group_codes(keys)
+        n_groups = len(group_keys[0]) if group_keys else 1
+        counts = np.bincount(inverse, minlength=n_groups)
+        if func == "count":
+            result = counts
+        elif func in ("sum", "mean"):
+            result = np.bincount(inverse, weights=self[value], minlength=n_groups)
+            if func == "mean":
+                result = result / counts
+        elif func in ("min", "max"):
+            ufunc = np.minimum if func == "min" else np.maximum
+            order = np.argsort(inverse, kind="stable")
+            starts = np.searchsorted(inverse[order], np.arange(n_groups))
+            result = ufunc.reduceat(self[value][order], starts)
+        else:
+            raise ValueError(f"Unknown aggregation '{func}'.")
+        labels = list(zip(*(k.tolist() for k in group_keys))) if group_keys else [()]
+        if len(keys) == 1:
+            labels = [label[0] for label in labels]
+        return dict(zip(labels, result.tolist()))
+
+    def top_per_group(self, keys, by):
+        """
+        For every group of `keys`, the most frequent value of column `by`, its count and the
+        index of its first row (ties go to the value seen first, like statistics.mode).
+        """
+        if isinstance(keys, str):
+            keys = [keys]
+        group_keys, inverse = self.group_codes(list(keys) + [by])
+        n_pairs = len(group_keys[0])
+        counts = np.bincount(inverse, minlength=n_pairs)
+        first_row = np.full(n_pairs, self.n_obs)
+        np.minimum.at(first_row, inverse, np.arange(self.n_obs))
+        # pairs are sorted by the outer keys: sort each group by count (descending) then first row
+        outer = group_keys[:-1]
+        order = np.lexsort([first_row, -counts] + outer[::-1])
+        outer_labels = list(zip(*(k[order].tolist() for k in outer)))
+        top = {}
+        for label, pair in zip(outer_labels, order):
+            label = label[0] if len(keys) == 1 else label
+            if label not in top:
+                top[label] = (group_keys[-1][pair].item(), int(counts[pair]), int(first_row[pair]))
+        return top
+
+
+def report_general_stats(catalogue):
+    print(len(catalogue))
+    print("Total duration (hours) of SMART VCS observations:", catalogue["duration"].sum() / 3600)
+    print("Total space (PiB) occupied by SMART VCS:", catalogue["total_archived_bytes"].sum() / 1024**5)
+
+
+def report_top_project_per_year(catalogue):
+    names = catalogue["projectshortname"]
+    for year, (pid, count, first_row) in catalogue.top_per_group("year", "projectid").items():
+        print(f"Year {year} - Top project: {pid} ({count}) - {names[first_row]}")
+
+
+def report_hours_per_project(catalogue):
+    total = catalogue["duration"].sum()
+    for pid, duration in catalogue.aggregate("projectid", "duration", "sum").items():
+        print(f"Project code: {pid:5}, hours: {duration / 3600:8.1f} ({100 * duration / total:5.1f}%)")
+
+
+def report_proj_to_freq(catalogue):
+    proj_to_freq = {}
+    for (pid, frq), count in catalogue.aggregate(["projectid", "center_frequency_mhz"]).items():
+        proj_to_freq.setdefault(pid, []).append(f"Frequency: {frq},  count: {count}")
+    for pid, counts in proj_to_freq.items():
+        print(f"Project code: {pid:5}, {' - '.join(counts)}")
+
+
+def report_freq_to_project(catalogue):
+    freq_to_proj = {}
+    for (frq, pid), count in catalogue.aggregate(["center_frequency_mhz", "projectid"]).items():
+        freq_to_proj.setdefault(frq, []).append(f"Project: {pid},  count: {count}")
+    for frq, counts in freq_to_proj.items():
+        print(f"Central frequency: {frq:5}, {' - '.join(counts)}")
+
+
+def report_category(catalogue, category):
+    for value, count in catalogue.aggregate(category).items():
+        print(f"{category}: {value}, count: {count}")
+
+
+REPORTS = {
+    "stats": report_general_stats,
+    "years": report_top_project_per_year,
+    "hours": report_hours_per_project,
+    "proj_to_freq": report_proj_to_freq,
+    "freq_to_proj": report_freq_to_project,
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--report", type=str, default="stats",
+                        help=f"Comma-separated reports to run on the same catalogue: {', '.join(REPORTS)} or "
+                             "category:<column> (e.g. category:mode, category:mwa_array_configuration).")
+    parser.add_argument("--project", type=str, default=None, help="Only keep the observations of this project.")
+    parser.add_argument("--min-duration", type=int, default=None, help="Only keep observations at least this long (seconds).")
+    parser.add_argument("--exclude-calibration", action='store_true', help="Drop calibration observations.")
+    parser.add_argument("--exclude-deleted", action='store_true', help="Drop deleted observations.")
+    parser.add_argument("--no-cache", action='store_true', help="Do not read or write the .npz column cache.")
+    parser.add_argument("XML FILE", nargs='+', type=str, help="ASVO VOTable exports.")
+    args = vars(parser.parse_args())
+
+    catalogue = ObservationCatalogue.from_files(args["XML FILE"], not args["no_cache"])
+    mask = np.ones(len(catalogue), dtype=bool)
+    if args["exclude_calibration"]:
+        mask &= ~catalogue["calibration"]
+    if args["exclude_deleted"]:
+        mask &= ~catalogue["deleted_flag"]
+    if args["min_duration"] is not None:
+        mask &= catalogue["duration"] >= args["min_duration"]
+    conditions = {} if args["project"] is None else {"projectid": args["project"]}
+    catalogue = catalogue.filter(mask, **conditions)
+
+    for report in args["report"].split(","):
+        print(f"== {report} ==")
+        if report.startswith("category:"):
+            report_category(catalogue, report.split(":", 1)[1])
+        elif report in REPORTS:
+            REPORTS[report](catalogue)
+        else:
+            parser.error(f"unknown report '{report}'")
@@ -1,3 +1,4 @@
+import os
 from math import sqrt, pi, pow
 
 SPEED_OF_LIGHT = 299792458 # m/s
@@ -8,6 +9,14 @@ def dispersive_delay_ms(DM, f1_ghz, f2_ghz):
 def dispersive_delay_s(DM, f1_ghz, f2_ghz):
     return dispersive_delay_ms(DM, f1_ghz, f2_ghz) / 1000
 
+def atomic_save(filename, write):
+    # Write through write(file) to a temporary file and rename it over `filename`,
+    # so concurrent runs never read a partially written file.
+    tmp_filename = f"{filename}.{os.getpid()}.tmp"
+    with open(tmp_filename, "wb") as f:
+        write(f)
+    os.replace(tmp_filename, filename)
+
 def freq_to_wavelength_m(freq_hz):
     return SPEED_OF_LIGHT / freq_hz
 
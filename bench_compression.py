@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+
+# Benchmark of FITS tile compression settings on dynamic spectra / BLINK images.
+# For every combination of compression type, quantization level and tile shape it reports
+# the compression ratio, the encode and decode throughput and the latency of reading a
+# random time window from the compressed file, which is what the dedispersion code does.
+
+import os
+import io
+import csv
+import time
+import tempfile
+import argparse
+import itertools
+import numpy as np
+from astropy.io import fits
+from convert_fits import compress_hdu
+from dedispersion import generate_sweep
+
+
+def load_images(filenames):
+    images = []
+    for filename in filenames:
+        with fits.open(filename) as hdul:
+            images.extend(np.array(hdu.data, dtype=np.float32) for hdu in hdul if hdu.data is not None and hdu.data.ndim == 2)
+    return images
+
+
+def synthetic_spectrum(dm = 300, f_low_mhz = 138.88, f_high_mhz = 169.6, freq_res_mhz = 0.04, int_time_s = 0.02):
+    return generate_sweep(dm, f_low_mhz, f_high_mhz, freq_res_mhz, int_time_s, 1, lambda : 5).astype(np.float32)
+
+
+def _tile_shape(spec, image_shape):
+    # "row" (astropy default), "full" or an explicit "ny,nx" shape
+    if spec == "row":
+        return None
+    if spec == "full":
+        return tuple(image_shape)
+    return tuple(min(int(x), n) for x, n in zip(spec.split(","), image_shape))
+
+
+def benchmark(image, compression_type, quantize_level, tile_spec, window, repeats, rng):
+    tile_shape = _tile_shape(tile_spec, image.shape)
+    raw_mb = image.nbytes / 1e6
+
+    encode_times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        encoded = compress_hdu(image, compression_type, tile_shape, quantize_level)
+        encode_times.append(time.perf_counter() - start)
+    # a complete FITS file: empty primary header + compressed extension
+    file_bytes = fits.PrimaryHDU().header.tostring().encode("ascii") + encoded
+
+    decode_times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        with fits.open(io.BytesIO(file_bytes)) as hdul:
+            decoded = hdul[1].data
+        decode_times.append(time.perf_counter() - start)
+    max_error = float(np.nanmax(np.abs(decoded - image)))
+
+    window_times = []
+    with tempfile.NamedTemporaryFile(suffix=".fits", delete=False) as f:
+        f.write(file_bytes)
+    try:
+        for _ in range(repeats):
+            t0 = int(rng.integers(0, max(1, image.shape[1] - window)))
+            start = time.perf_counter()
+            with fits.open(f.name) as hdul:
+                hdul[1].section[:, t0:t0 + window]
+            window_times.append(time.perf_counter() - start)
+    finally:
+        os.remove(f.name)
+
+    return {"compression": compression_type, "quantize_level": quantize_level, "tile_shape": tile_spec,
+            "ratio": image.nbytes / len(encoded), "encode_mb_s": raw_mb / np.median(encode_times),
+            "decode_mb_s": raw_mb / np.median(decode_times), "window_ms": 1e3 * np.median(window_times),
+            "max_error": max_error}
+
+
+def print_results(results):
+    print(f"{'compression':12s} {'quant':>6s} {'tile':>10s} {'ratio':>7s} {'enc MB/s':>9s} {'dec MB/s':>9s} {'window ms':>10s} {'max err':>9s}")
+    for r in results:
+        if "error" in r:
+            print(f"{r['compression']:12s} {r['quantize_level']:6g} {r['tile_shape']:>10s}   failed: {r['error']}")
+        else:
+            print(f"{r['compression']:12s} {r['quantize_level']:6g} {r['tile_shape']:>10s} {r['ratio']:7.2f} {r['encode_mb_s']:9.1f} "
+                  f"{r['decode_mb_s']:9.1f} {r['window_ms']:10.2f} {r['max_error']:9.3g}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--compression", type=str, default="RICE_1,GZIP_1,GZIP_2,HCOMPRESS_1,PLIO_1", help="Comma-separated compression types.")
+    parser.add_argument("--quantize-levels", type=str, default="4,16,64", help="Comma-separated quantization levels.")
+    parser.add_argument("--tile-shapes", type=str, default="row;16,256;64,64;full", help="Semicolon-separated tile shapes ('row', 'full' or 'ny,nx').")
+    parser.add_argument("--window", type=int, default=256, help="Number of time steps in the random window read.")
+    parser.add_argument("--repeats", type=int, default=3, help="Repetitions of every timing (the median is reported).")
+    parser.add_argument("--output", type=str, default=None, help="Optional CSV file with the results.")
+    parser.add_argument("FITS FILE", nargs='*', type=str, help="Sample BLINK images or dynamic spectra. A synthetic sweep is used if none is given.")
+    args = vars(parser.parse_args())
+
+    images = load_images(args["FITS FILE"]) if args["FITS FILE"] else [synthetic_spectrum()]
+    rng = np.random.default_rng(0)
+    results = []
+    settings = itertools.product(args["compression"].split(","), [float(q) for q in args["quantize_levels"].split(",")],
+                                 args["tile_shapes"].split(";"))
+    for compression_type, quantize_level, tile_spec in settings:
+        image_results = []
+        for image in images:
+            try:
+                image_results.append(benchmark(image, compression_type, quantize_level, tile_spec, args["window"], args["repeats"], rng))
+            except Exception as e:
+                image_results = [{"compression": compression_type, "quantize_level": quantize_level, "tile_shape": tile_spec, "error": str(e)}]
+                break
+        if "error" in image_results[0]:
+            results.append(image_results[0])
+        else:
+            # average over the sample images
+            merged = dict(image_results[0])
+            for key in ["ratio", "encode_mb_s", "decode_mb_s", "window_ms"]:
+                merged[key] = float(np.mean([r[key] for r in image_results]))
+            merged["max_error"] = max(r["max_error"] for r in image_results)
+            results.append(merged)
+
+    print_results(results)
+    if args["output"] is not None:
+        with open(args["output"], "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=["compression", "quantize_level", "tile_shape", "ratio", "encode_mb_s",
+                                                   "decode_mb_s", "window_ms", "max_error", "error"])
+            writer.writeheader()
+            writer.writerows(results)
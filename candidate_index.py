@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+
+# Persistent SQLite index of the dynamic_spectrum_*.fits candidates in one or more
+# directories. A scan lists each directory once and only reads the FITS header of files
+# that are new or changed since the previous scan, so selecting candidates by DM or pixel
+# region does not need to list or open the files again.
+
+import os
+import sqlite3
+import argparse
+from astropy.io import fits
+from candidates import extract_filename_info
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS candidates (
+    path TEXT PRIMARY KEY,
+    directory TEXT NOT NULL,
+    x INTEGER, y INTEGER, dm REAL, offset INTEGER, cand_id TEXT,
+    size INTEGER, mtime REAL, nchans INTEGER, ntimesteps INTEGER,
+    snr REAL, width INTEGER, peak_time REAL, n_peaks INTEGER, best_dm REAL
+);
+CREATE INDEX IF NOT EXISTS candidates_dm ON candidates (dm);
+CREATE INDEX IF NOT EXISTS candidates_xy ON candidates (x, y);
+CREATE INDEX IF NOT EXISTS candidates_directory ON candidates (directory);
+"""
+
+
+def open_index(db_filename):
+    db = sqlite3.connect(db_filename)
+    db.executescript(_SCHEMA)
+    # indexes created before best_dm was recorded
+    if "best_dm" not in [row[1] for row in db.execute("PRAGMA table_info(candidates)")]:
+        db.execute("ALTER TABLE candidates ADD COLUMN best_dm REAL")
+    return db
+
+
+def scan_directory(db, directory):
+    """
+    Add new and changed candidate files in `directory` to the index and remove the ones
+    that disappeared. Processing results of changed files are cleared.
+    Returns the number of (added or updated, removed) files.
+    """
+    directory = os.path.abspath(directory)
+    known = {path: (size, mtime) for path, size, mtime in
+             db.execute("SELECT path, size, mtime FROM candidates WHERE directory = ?", (directory,))}
+    rows, seen = [], set()
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            try:
+                x, y, dm, offset, cand_id = extract_filename_info(entry.name)
+            except ValueError:
+                continue
+            path = os.path.join(directory, entry.name)
+            seen.add(path)
+            stat = entry.stat()
+            if known.get(path) == (stat.st_size, stat.st_mtime):
+                continue
+            try:
+                header = fits.getheader(path)
+            except OSError:
+                # unreadable files stay in the index without shape, filtering reports the error
+                header = {}
+            rows.append((path, directory, x, y, dm, offset, cand_id, stat.st_size, stat.st_mtime,
+                         header.get("NAXIS2"), header.get("NAXIS1")))
+    removed = [(path,) for path in known if path not in seen]
+    with db:
+        db.executemany("INSERT OR REPLACE INTO candidates (path, directory, x, y, dm, offset, cand_id, "
+                       "size, mtime, nchans, ntimesteps) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        db.executemany("DELETE FROM candidates WHERE path = ?", removed)
+    return len(rows), len(removed)
+
+
+def select_candidates(db, dm_min = None, dm_max = None, region = None, min_snr = None):
+    """
+    Paths of the indexed candidates with DM in [dm_min, dm_max], pixel inside
+    region = (x_min, x_max, y_min, y_max) and SNR >= min_snr. None disables a condition.
+    """
+    conditions, params = [], []
+    if dm_min is not None:
+        conditions.append("dm >= ?")
+        params.append(dm_min)
+    if dm_max is not None:
+        conditions.append("dm <= ?")
+        params.append(dm_max)
+    if region is not None:
+        conditions.append("x BETWEEN ? AND ? AND y BETWEEN ? AND ?")
+        params.extend(region)
+    if min_snr is not None:
+        conditions.append("snr >= ?")
+        params.append(min_snr)
+    query = "SELECT path FROM candidates"
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    return [path for path, in db.execute(query + " ORDER BY path", params)]
+
+
+def record_results(db, results):
+    # results as returned by dedisp_fits.filter_candidates; files that failed keep no result
+    with db:
+        db.executemany("UPDATE candidates SET snr = ?, width = ?, peak_time = ?, n_peaks = ?, best_dm = ? WHERE path = ?",
+                       [(snr, width, peak_time, n_peaks, best_dm, os.path.abspath(path))
+                        for path, dm, best_dm, snr, width, peak_time, n_peaks, error in results if not error])
+
+
+def parse_region(region):
+    # "x_min,x_max,y_min,y_max" -> tuple of ints
+    if region is None:
+        return None
+    return tuple(int(v) for v in region.split(","))
+
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dm-min", type=float, default=None, help="Minimum DM of the selected candidates.")
+    parser.add_argument("--dm-max", type=float, default=None, help="Maximum DM of the selected candidates.")
+    parser.add_argument("--region", type=str, default=None, help="Pixel region of the selected candidates as x_min,x_max,y_min,y_max.")
+    parser.add_argument("--min-snr", type=float, default=None, help="Minimum SNR recorded by a previous filtering run.")
+    parser.add_argument("--scan", action="append", default=[], help="Directory to (re)scan before the query (repeat for several directories).")
+    parser.add_argument("INDEX", type=str, help="SQLite index file.")
+
+    args = vars(parser.parse_args())
+    db = open_index(args["INDEX"])
+    for directory in args["scan"]:
+        n_updated, n_removed = scan_directory(db, directory)
+        print(f"{directory}: {n_updated} files added or updated, {n_removed} removed.")
+    if not args["scan"] or any(args[k] is not None for k in ["dm_min", "dm_max", "region", "min_snr"]):
+        for path in select_candidates(db, args["dm_min"], args["dm_max"], parse_region(args["region"]), args["min_snr"]):
+            print(path)
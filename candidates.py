@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+
+# Candidate metadata and friends-of-friends clustering of candidates from neighbouring
+# pixels, DMs and times. Candidates are (x, y, dm, offset, cand_id) tuples, as returned by
+# extract_filename_info. Two candidates are friends when they are within the
+# given radius along every axis; clusters are the connected components of that relation.
+# Points are hashed on a grid with cells the size of the radii, so only candidates in
+# neighbouring cells are compared and the cost is close to linear in their number.
+
+from itertools import product
+import numpy as np
+
+
+def extract_filename_info(filename : str):
+    # dynamic_spectrum_00043_00040_dm_397.0_offset_188_candID_6998.fits
+    if not filename.startswith("dynamic_spectrum"): raise ValueError()
+    components = filename.split('_')
+    if len(components) != 10: raise ValueError()
+    x, y = int(components[2]), int(components[3])
+    dm = float(components[5])
+    offset = int(components[7])
+    cand_id = components[9][:-5]
+    return x, y, dm, offset, cand_id
+
+
+def _connected_components(n_points, first, second):
+    # Label propagation with pointer jumping: every point ends up labelled with the smallest
+    # index in its component.
+    labels = np.arange(n_points)
+    while True:
+        previous = labels.copy()
+        np.minimum.at(labels, first, labels[second])
+        np.minimum.at(labels, second, labels[first])
+        labels = labels[labels]
+        if np.array_equal(labels, previous):
+            return labels
+
+
+def cluster_candidates(candidates, pixel_radius, dm_radius, time_radius):
+    """
+    Returns an array with the cluster label (0, 1, ...) of every candidate.
+    """
+    radii = np.array([pixel_radius, pixel_radius, dm_radius, time_radius], dtype=np.float64)
+    if np.any(radii <= 0):
+        raise ValueError("Clustering radii must be positive.")
+    points = np.array([c[:4] for c in candidates], dtype=np.float64).reshape(-1, 4) / radii
+    n_points = len(points)
+    if n_points == 0:
+        return np.zeros(0, dtype=int)
+
+    # Encode grid cells as integers, with a margin of one cell so neighbours never wrap.
+    cells = np.floor(points).astype(np.int64)
+    cells -= cells.min(axis=0) - 1
+    dims = cells.max(axis=0) + 2
+    strides = np.array([dims[1] * dims[2] * dims[3], dims[2] * dims[3], dims[3], 1], dtype=np.int64)
+    keys = cells @ strides
+    order = np.argsort(keys, kind="stable")
+    sorted_keys = keys[order]
+
+    first, second = [], []
+    # neighbouring cells that come after (or are) the current one, so every pair is visited once
+    for step in product((-1, 0, 1), repeat=4):
+        if step < (0, 0, 0, 0):
+            continue
+        neighbour_keys = keys + np.array(step, dtype=np.int64) @ strides
+        lo = np.searchsorted(sorted_keys, neighbour_keys, side="left")
+        counts = np.searchsorted(sorted_keys, neighbour_keys, side="right") - lo
+        i = np.repeat(np.arange(n_points), counts)
+        pos = np.repeat(lo - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+        j = order[pos]
+        close = np.abs(points[i] - points[j]).max(axis=1) <= 1
+        if step == (0, 0, 0, 0):
+            close &= i < j
+        first.append(i[close])
+        second.append(j[close])
+
+    labels = _connected_components(n_points, np.concatenate(first), np.concatenate(second))
+    return np.unique(labels, return_inverse=True)[1].reshape(-1)
+
+
+def cluster_representatives(candidates, labels, pixel_radius, dm_radius, time_radius):
+    """
+    Index of one candidate per cluster: the one closest to the median position of its
+    cluster, with distances measured in units of the clustering radii.
+    """
+    radii = np.array([pixel_radius, pixel_radius, dm_radius, time_radius], dtype=np.float64)
+    points = np.array([c[:4] for c in candidates], dtype=np.float64).reshape(-1, 4) / radii
+    order = np.argsort(labels, kind="stable")
+    boundaries = np.flatnonzero(np.diff(labels[order])) + 1
+    representatives = []
+    for members in np.split(order, boundaries):
+        if len(members) == 0:
+            continue
+        cluster = points[members]
+        spread = np.abs(cluster - np.median(cluster, axis=0)).sum(axis=1)
+        representatives.append(int(members[np.argmin(spread)]))
+    return representatives
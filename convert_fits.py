@@ -1,9 +1,19 @@
 #!/usr/bin/env python3
 import numpy as np
 from astropy.io import fits
-import sys
 import os
+import io
+import time
 import pathlib
+import argparse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+
+COMPRESSION_TYPES = ["RICE_1", "GZIP_1", "GZIP_2", "HCOMPRESS_1", "PLIO_1", "NOCOMPRESS"]
+
+# Size of the header-only primary HDU that astropy writes in front of a lone extension.
+_EMPTY_PRIMARY_SIZE = len(fits.PrimaryHDU().header.tostring())
 
 
 def gps_to_unix(gps_time):
@@ -32,20 +42,84 @@ def covert_to_new_format(blink_fits):
     return hdul
 
 
+def compress_hdu(data, compression_type = "RICE_1", tile_shape = None, quantize_level = 16.0):
+    """
+    Compress an image into a CompImageHDU and return the bytes of the encoded extension,
+    ready to be appended to a FITS file. A header-only HDU (`data` None) gives an empty one.
+    """
+    comp_hdu = fits.CompImageHDU(data=None if data is None else np.asarray(data), compression_type=compression_type,
+                                 tile_shape=tile_shape, quantize_level=quantize_level)
+    buffer = io.BytesIO()
+    fits.HDUList([fits.PrimaryHDU(), comp_hdu]).writeto(buffer)
+    return buffer.getvalue()[_EMPTY_PRIMARY_SIZE:]
+
+
+def _primary_header_bytes(time_value, millitim):
+    primary_hdu = fits.PrimaryHDU()
+    primary_hdu.header['TIME'] = time_value
+    primary_hdu.header['MILLITIM'] = millitim
+    primary_hdu.header['MARKER'] = 0
+    return primary_hdu.header.tostring().encode("ascii")
+
+
+def convert_file(input_filename, output_filename, executor, compression_type = "RICE_1", tile_shape = None,
+                 quantize_level = 16.0, max_pending = 8):
+    """
+    Streaming equivalent of covert_to_new_format(fits.open(input_filename)).writeto(output_filename).
+
+    The input is memory-mapped and its HDUs are read one at a time and compressed on
+    `executor`; at most `max_pending` HDUs are in flight and they are written in order.
+    Returns (input bytes, output bytes, number of HDUs).
+    """
+    input_bytes, n_hdus = 0, 0
+    pending = deque()
+    with fits.open(input_filename, memmap=True) as blink_fits, open(output_filename, "wb") as out:
+        time_value, millitim = blink_fits[0].header['TIME'], 0
+        # placeholder, rewritten at the end with the time of the last HDU
+        out.write(_primary_header_bytes(time_value, millitim))
+        for blink_hdu in blink_fits:
+            time_value, millitim = blink_hdu.header['TIME'], blink_hdu.header['MILLITIM']
+            pending.append(executor.submit(compress_hdu, blink_hdu.data, compression_type, tile_shape, quantize_level))
+            input_bytes += 0 if blink_hdu.data is None else blink_hdu.data.nbytes
+            n_hdus += 1
+            while len(pending) >= max_pending:
+                out.write(pending.popleft().result())
+        while pending:
+            out.write(pending.popleft().result())
+        output_bytes = out.tell()
+        out.seek(0)
+        out.write(_primary_header_bytes(time_value, millitim))
+    return input_bytes, output_bytes, n_hdus
+
+
 if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        print(f"Usage: {sys.argv[0]} <gpubox file 1> <gpubox file 2> ...")
-        exit(0)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--compression", type=str, default="RICE_1", choices=COMPRESSION_TYPES, help="Tile compression algorithm.")
+    parser.add_argument("--tile-shape", type=str, default=None, help="Comma-separated tile shape (default: one row per tile).")
+    parser.add_argument("--quantize-level", type=float, default=16.0, help="Quantization level of floating point images.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Number of HDUs compressed in parallel.")
+    parser.add_argument("--processes", action='store_true', help="Compress in worker processes instead of threads.")
+    parser.add_argument("--output-dir", type=str, default="converted", help="Output directory.")
+    parser.add_argument("GPUBOX FILE", nargs='+', type=str, help="BLINK FITS files to convert.")
+    args = vars(parser.parse_args())
 
-    output_dir = 'converted'
-    p = pathlib.Path(output_dir)
+    p = pathlib.Path(args["output_dir"])
     if not p.exists():
         p.mkdir()
-    
-    for file in sys.argv[1:]:
-        blink_fits = fits.open(file)
-        filename = pathlib.Path(file).name
-        new_fits = covert_to_new_format(blink_fits)
-        new_fits.writeto(f"converted/{filename}", overwrite=True)
+    tile_shape = None if args["tile_shape"] is None else tuple(int(x) for x in args["tile_shape"].split(","))
 
-    
+    pool = ProcessPoolExecutor if args["processes"] else ThreadPoolExecutor
+    total_in, total_hdus, total_start = 0, 0, time.perf_counter()
+    with pool(max_workers=args["workers"]) as executor:
+        for file in args["GPUBOX FILE"]:
+            filename = pathlib.Path(file).name
+            start = time.perf_counter()
+            input_bytes, output_bytes, n_hdus = convert_file(file, p / filename, executor, args["compression"], tile_shape,
+                                                             args["quantize_level"], 2 * args["workers"])
+            elapsed = time.perf_counter() - start
+            total_in += input_bytes
+            total_hdus += n_hdus
+            print(f"{filename}: {n_hdus} HDUs, ratio {input_bytes / output_bytes:.2f}, "
+                  f"{input_bytes / 1e6 / elapsed:.1f} MB/s, {n_hdus / elapsed:.1f} HDUs/s")
+    elapsed = time.perf_counter() - total_start
+    print(f"Total: {total_hdus} HDUs in {elapsed:.1f} s, {total_in / 1e6 / elapsed:.1f} MB/s, {total_hdus / elapsed:.1f} HDUs/s")
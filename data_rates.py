@@ -1,3 +1,5 @@
+import csv
+import numpy as np
 import matplotlib.pyplot as plt
 from argparse import ArgumentParser
 from models import MWA_PHASE_1, Correlator, Imager, Dedispersion
@@ -6,13 +8,27 @@ from basics import dispersive_delay_ms
 
 
 
+MWA_BANDWIDTH_MHZ = 30.72
+# time series kept in addition to the dispersive delay when de-dispersing
+DEDISP_BUFFER_S = 2
+
+
+def dedispersion_delay_s(repr_dm, bwcentre_mhz, integration_time_s, bandwidth_mhz = MWA_BANDWIDTH_MHZ):
+    """
+    Dispersive delay across the band for a DM of repr_dm, and the same delay rounded up
+    to a whole number of integrations. Works on NumPy arrays too.
+    """
+    lb_ghz = (bwcentre_mhz - bandwidth_mhz/2) / 1000
+    hb_ghz = (bwcentre_mhz + bandwidth_mhz/2) / 1000
+    delay_s = dispersive_delay_ms(repr_dm, lb_ghz, hb_ghz) / 1000
+    delay_final = (np.floor(delay_s / integration_time_s) + 1) * integration_time_s
+    return delay_s, delay_final
+
+
 def display_data_requirements(integration_time_s, channel_avg_factor, image_side, bits_per_pixel, n_dm_trials, repr_dm, bwcentre_mhz):
     # dispersive delay for 30MHz of bandwidth centered at 150MHz with a DM of 600
-    lb_ghz = (bwcentre_mhz - 30.72/2) / 1000
-    hb_ghz = (bwcentre_mhz + 30.72/2) / 1000
-    delay_s = dispersive_delay_ms(repr_dm, lb_ghz, hb_ghz) / 1000
-    delay_final = (int(delay_s / integration_time_s) + 1) * integration_time_s
-    buffer_size_s = 2
+    delay_s, delay_final = dedispersion_delay_s(repr_dm, bwcentre_mhz, integration_time_s)
+    buffer_size_s = DEDISP_BUFFER_S
     CORRELATOR = Correlator(MWA_PHASE_1, integration_time_s, channel_avg_factor)
     IMAGER = Imager(image_side, bits_per_pixel, CORRELATOR)
     DEDISP = Dedispersion(n_dm_trials, IMAGER)
@@ -20,7 +36,7 @@ def display_data_requirements(integration_time_s, channel_avg_factor, image_side
     vcs_gibps =  MWA_PHASE_1.data_rate / 1024**3 / 8
     corr_gibps = CORRELATOR.data_rate  / 1024**3 / 8
     imaging_gibps = IMAGER.data_rate  / 1024**3 / 8
-    dedispersion_gibps = DEDISP.data_date / 1024**3 / 8
+    dedispersion_gibps = DEDISP.data_rate / 1024**3 / 8
     print(f"Input parameters\n================\n"
           f"Integration time (s):        {integration_time_s}\n"
           f"N. fine channels:            {3072 // 4}\n"
@@ -52,25 +68,93 @@ def display_data_requirements(integration_time_s, channel_avg_factor, image_side
 
 
 
+SWEEP_PARAMETERS = ["integration_time_s", "channel_avg_factor", "image_side", "bits_per_pixel", "n_dm_trials"]
+SWEEP_RATES = ["vcs_gibps", "visibilities_gibps", "images_gibps", "dedisp_gibps", "delay_s", "dynspec_gib", "dmtime_gib"]
+
+
+def data_rate_sweep(integration_time_s, channel_avg_factor, image_side, bits_per_pixel, n_dm_trials,
+                    repr_dm = 600, bwcentre_mhz = 150, interferometer = MWA_PHASE_1):
+    """
+    Vectorised display_data_requirements over the grid of all the combinations of the
+    given values (scalars or sequences). The Correlator/Imager/Dedispersion chain is built
+    once on broadcastable arrays. Returns a dict of columns, one row per configuration:
+    the parameters (SWEEP_PARAMETERS), the output rates in GiB per second of observation,
+    the dispersive delay and the volumes (GiB) needed to de-disperse (SWEEP_RATES).
+    """
+    grids = np.meshgrid(*(np.atleast_1d(np.asarray(x, dtype=np.float64)) for x in
+                          (integration_time_s, channel_avg_factor, image_side, bits_per_pixel, n_dm_trials)),
+                        indexing="ij", sparse=True)
+    int_time, avg_factor, side, bpp, n_dms = grids
+    correlator = Correlator(interferometer, int_time, avg_factor)
+    imager = Imager(side, bpp, correlator)
+    dedisp = Dedispersion(n_dms, imager)
+    delay_s, delay_final = dedispersion_delay_s(repr_dm, bwcentre_mhz, int_time)
+
+    images_gibps = imager.data_rate / 1024**3 / 8
+    dedisp_gibps = dedisp.data_rate / 1024**3 / 8
+    columns = {
+        "vcs_gibps": interferometer.data_rate / 1024**3 / 8,
+        "visibilities_gibps": correlator.data_rate / 1024**3 / 8,
+        "images_gibps": images_gibps,
+        "dedisp_gibps": dedisp_gibps,
+        "delay_s": delay_s,
+        "dynspec_gib": images_gibps * delay_s,
+        "dmtime_gib": dedisp_gibps * (delay_final + DEDISP_BUFFER_S),
+    }
+    shape = np.broadcast_shapes(*(g.shape for g in grids))
+    table = {name: np.broadcast_to(g, shape).ravel() for name, g in zip(SWEEP_PARAMETERS, grids)}
+    table.update({name: np.broadcast_to(v, shape).ravel() for name, v in columns.items()})
+    return table
+
+
+def write_sweep(table, output_filename):
+    names = SWEEP_PARAMETERS + SWEEP_RATES
+    with open(output_filename, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(names)
+        writer.writerows(zip(*(table[n].tolist() for n in names)))
+
+
+def _grid(text, dtype):
+    # "a,b,c" or "start:stop:step" (stop included)
+    if ":" in text:
+        start, stop, step = (dtype(x) for x in text.split(":"))
+        return np.arange(start, stop + step / 2, step, dtype=np.float64)
+    return np.array([dtype(x) for x in text.split(",")], dtype=np.float64)
+
+
 if __name__ == "__main__":
 
     parser = ArgumentParser()
 
-    parser.add_argument("--inttime", "-t", type=float, required=True, help="Integration time (in seconds).")
-    parser.add_argument("--avg", "-c", required=True, type=int, help="Fine channel averaging factor.")
-    parser.add_argument("--imageside", "-s", type=int, required=True, help="Image side size.")
-    parser.add_argument("--bpp", "-b", type=int, default=32, help="Bits used to represent an image pixel.")
-    parser.add_argument("--dmtrials", "-d", required=True, type=int, help="Number of DM trials.")
+    parser.add_argument("--inttime", "-t", type=str, required=True, help="Integration time (in seconds). A list 'a,b,c' or range 'start:stop:step' runs a sweep.")
+    parser.add_argument("--avg", "-c", required=True, type=str, help="Fine channel averaging factor (list or range for a sweep).")
+    parser.add_argument("--imageside", "-s", type=str, required=True, help="Image side size (list or range for a sweep).")
+    parser.add_argument("--bpp", "-b", type=str, default="32", help="Bits used to represent an image pixel (list or range for a sweep).")
+    parser.add_argument("--dmtrials", "-d", required=True, type=str, help="Number of DM trials (list or range for a sweep).")
     parser.add_argument("--bwcentre", type=float, default=150, help="Centre of the 30.72MHz MWA bandwidth (in MHz).")
     parser.add_argument("--dm", type=float, default=600, help="Representative DM used to compute the dispersive delay (in pc cm-3).")
+    parser.add_argument("--output", "-o", type=str, default=None, help="CSV file where the sweep table is written.")
     args = vars(parser.parse_args())
 
-    display_data_requirements(
-        integration_time_s=args["inttime"],
-        channel_avg_factor=args["avg"],
-        image_side=args["imageside"],
-        bits_per_pixel=args["bpp"],
-        n_dm_trials=args["dmtrials"],
-        repr_dm=args["dm"],
-        bwcentre_mhz=args["bwcentre"]
-    )
+    grids = [_grid(args[name], dtype) for name, dtype in
+             [("inttime", float), ("avg", int), ("imageside", int), ("bpp", int), ("dmtrials", int)]]
+    if args["output"] is None and all(len(g) == 1 for g in grids):
+        display_data_requirements(
+            integration_time_s=float(grids[0][0]),
+            channel_avg_factor=int(grids[1][0]),
+            image_side=int(grids[2][0]),
+            bits_per_pixel=int(grids[3][0]),
+            n_dm_trials=int(grids[4][0]),
+            repr_dm=args["dm"],
+            bwcentre_mhz=args["bwcentre"]
+        )
+    else:
+        table = data_rate_sweep(*grids, repr_dm=args["dm"], bwcentre_mhz=args["bwcentre"])
+        if args["output"] is not None:
+            write_sweep(table, args["output"])
+        else:
+            names = SWEEP_PARAMETERS + SWEEP_RATES
+            print(" ".join(f"{n:>18s}" for n in names))
+            for row in zip(*(table[n] for n in names)):
+                print(" ".join(f"{v:18.4g}" for v in row))
@@ -1,28 +1,38 @@
 #!/usr/bin/env python3
 
 from math import ceil, floor
+from functools import lru_cache, partial
+import hashlib
 from astropy.io import fits
 import argparse
 import numpy as np
 from matplotlib import pyplot as plt
 from matplotlib.transforms import Affine2D
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 import os
 import shutil
+import csv
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from basics import atomic_save
+from fdmt import fdmt_dm_time_plane
+from robust_stats import median_and_iqr_stdev, threshold_peaks
+from candidates import extract_filename_info, cluster_candidates, cluster_representatives
+from candidate_index import open_index, scan_directory, select_candidates, record_results, parse_region
 
 SPEED_OF_LIGHT = 299792458 # m/s
 K = 4.15
+# Directory where delay tables are memoized across runs (None disables the on-disk cache).
+DELAY_CACHE_DIR = None
 
 
-def extract_filename_info(filename : str):
-    # dynamic_spectrum_00043_00040_dm_397.0_offset_188_candID_6998.fits
-    if not filename.startswith("dynamic_spectrum"): raise ValueError()
-    components = filename.split('_')
-    if len(components) != 10: raise ValueError()
-    x, y = int(components[2]), int(components[3])
-    dm = float(components[5])
-    offset = int(components[7])
-    cand_id = components[9][:-5]
-    return x, y, dm, offset, cand_id
+def select_cluster_representatives(filenames, pixel_radius, dm_radius, time_radius):
+    # Keep one file per cluster of candidates close in pixel, DM and time offset.
+    candidates = [extract_filename_info(os.path.basename(f)) for f in filenames]
+    labels = cluster_candidates(candidates, pixel_radius, dm_radius, time_radius)
+    representatives = cluster_representatives(candidates, labels, pixel_radius, dm_radius, time_radius)
+    return [filenames[i] for i in sorted(representatives)]
 
 
 
@@ -39,54 +49,91 @@ def to_fits(data, output_filename):
 
 
 
-def average_channels(dyspec, avg_factor):
-    dyspec -= np.nanmedian(dyspec, axis=1)[:,np.newaxis]
+def average_channels(dyspec, avg_factor, nan_aware = False, inplace = False, out = None):
+    """
+    Subtract the median of every channel, then average groups of `avg_factor` channels.
+    The median subtraction is done on a copy unless `inplace` is set. If given, the result
+    is written into `out`, of shape (nchan / avg_factor, nt).
+    """
+    medians = np.nanmedian(dyspec, axis=1)[:,np.newaxis]
+    if inplace:
+        dyspec -= medians
+    else:
+        dyspec = dyspec - medians
     orig_freq_dim, orig_ts_dim = dyspec.shape
     if orig_freq_dim % avg_factor != 0:
         raise Exception("Averaging factor is not a multiple of the number of channels.")
-    new_freq_dim = int(orig_freq_dim / avg_factor)
-    new_dyspec = np.ndarray((new_freq_dim, orig_ts_dim))
-    for i in range(new_freq_dim):
-        new_dyspec[i, :] = np.mean(dyspec[i*avg_factor:i*avg_factor + avg_factor, :], axis=0)
-    
-    return new_dyspec
+    new_freq_dim = orig_freq_dim // avg_factor
+    if out is None:
+        out = np.empty((new_freq_dim, orig_ts_dim))
+    mean = np.nanmean if nan_aware else np.mean
+    mean(dyspec.reshape(new_freq_dim, avg_factor, orig_ts_dim), axis=1, out=out)
+    return out
 
 
 
-def average_timesteps(dyspec, avg_factor):
+def average_timesteps(dyspec, avg_factor, nan_aware = False, out = None):
+    """
+    Average groups of `avg_factor` contiguous time steps. The last group is averaged over
+    the remaining time steps when nt is not a multiple of `avg_factor`.
+    """
     orig_freq_dim, orig_ts_dim = dyspec.shape
-    new_ts_dim = int(ceil(orig_ts_dim / avg_factor))
-    new_dyspec = np.ndarray((orig_freq_dim, new_ts_dim))
-    for i in range(new_ts_dim):
-        new_dyspec[:, i] = np.mean(dyspec[:, i*avg_factor:i*avg_factor + avg_factor], axis=1)
-    
-    return new_dyspec
+    starts = np.arange(0, orig_ts_dim, avg_factor)
+    if nan_aware:
+        valid = ~np.isnan(dyspec)
+        sums = np.add.reduceat(np.where(valid, dyspec, 0), starts, axis=1, dtype=np.float64)
+        counts = np.add.reduceat(valid, starts, axis=1)
+    else:
+        sums = np.add.reduceat(dyspec, starts, axis=1, dtype=np.float64)
+        counts = np.diff(np.append(starts, orig_ts_dim))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.divide(sums, counts, out=out)
 
 
-def compute_time_series(dyspec):
-    return average_channels(dyspec, dyspec.shape[0])[0, :]
+def compute_time_series(dyspec, inplace = False):
+    return average_channels(dyspec, dyspec.shape[0], inplace=inplace)[0, :]
 
 
 
 def compute_iqr(values):
-    sorted_values = sorted(values)
-    q75 = int(len(sorted_values) * 0.75)
-    q25 = int(len(sorted_values) * 0.25)
-    iqr = sorted_values[q75] - sorted_values[q25]
-    stdev = iqr / 1.35
-    mean = sorted_values[int(len(sorted_values) / 2)]
-    return mean, stdev
+    return median_and_iqr_stdev(values)
+
 
 
+def peak_finding(values, snr_threshold = 5, window = None):
+    # window: if given, number of samples used to compute a local baseline around each sample
+    return threshold_peaks(values, snr_threshold, window)
 
-def peak_finding(values, snr_threshold = 5):
-    peak_idxs = []
-    mean, stdev = compute_iqr(values)
-    for i, val in enumerate(values):
-        estimated_snr = (val - mean) / stdev
-        if estimated_snr >= snr_threshold:
-            peak_idxs.append(i)
-    return peak_idxs
+
+
+def boxcar_search(series, widths = (1,)):
+    """
+    Matched-filter search with boxcars of the given widths (in samples), using cumulative sums.
+    `series` is a time series or a (ndm, nt) DM-time plane. Each row is normalised with its
+    median and IQR-based standard deviation. Returns, for every row, the best SNR, the width
+    achieving it and the index of the first sample in the boxcar.
+    """
+    series = np.atleast_2d(np.asarray(series, dtype=np.float64))
+    n_rows, n_timesteps = series.shape
+    median, stdev = median_and_iqr_stdev(series, axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        normalised = (series - median[:, np.newaxis]) / stdev[:, np.newaxis]
+    cumsum = np.zeros((n_rows, n_timesteps + 1))
+    np.cumsum(normalised, axis=1, out=cumsum[:, 1:])
+    best_snr = np.full(n_rows, -np.inf)
+    best_width = np.zeros(n_rows, dtype=int)
+    best_idx = np.zeros(n_rows, dtype=int)
+    for width in widths:
+        if width > n_timesteps: continue
+        # sum of `width` unit-variance samples has a standard deviation of sqrt(width)
+        boxcar_snr = (cumsum[:, width:] - cumsum[:, :-width]) / np.sqrt(width)
+        idx = np.argmax(boxcar_snr, axis=1)
+        row_snr = boxcar_snr[np.arange(n_rows), idx]
+        better = row_snr > best_snr
+        best_snr[better], best_width[better], best_idx[better] = row_snr[better], width, idx[better]
+    if n_rows == 1:
+        return best_snr[0], best_width[0], best_idx[0]
+    return best_snr, best_width, best_idx
 
 
 
@@ -102,33 +149,111 @@ def compute_frequency_list_ghz(central_freq_mhz, n_channels, channel_width_mhz):
 
 
 def compute_delay_table(frequencies, dm_list, int_time):
-    delay_table = np.zeros((len(dm_list), len(frequencies)), dtype=int)
-    top_freq_idx = len(frequencies) - 1
-    for dm_idx, dm in enumerate(dm_list):
-        delay_table[dm_idx, top_freq_idx] = 0
-        for i in range(len(frequencies) - 2, -1, -1):
-            delay_table[dm_idx, i] = int(round(dispersive_delay_s(dm, frequencies[i], frequencies[top_freq_idx]) / int_time))
+    frequencies = np.asarray(frequencies, dtype=np.float64)
+    dm_list = np.asarray(dm_list, dtype=np.float64)
+    # delay of every frequency w.r.t. the top one, for every DM, in time steps
+    delays_s = dispersive_delay_s(dm_list[:, np.newaxis], frequencies[np.newaxis, :], frequencies[-1])
+    return np.rint(delays_s / int_time).astype(int)
+
+
+
+@lru_cache(maxsize=32)
+def _cached_delay_table(frequencies, dm_list, int_time, cache_dir):
+    if cache_dir is not None:
+        key = hashlib.sha1(np.asarray(frequencies).tobytes() + np.asarray(dm_list).tobytes()
+                           + np.float64(int_time).tobytes()).hexdigest()
+        cache_file = os.path.join(cache_dir, f"delay_table_{key}.npy")
+        if os.path.exists(cache_file):
+            delay_table = np.load(cache_file)
+        else:
+            delay_table = compute_delay_table(frequencies, dm_list, int_time)
+            os.makedirs(cache_dir, exist_ok=True)
+            atomic_save(cache_file, lambda f: np.save(f, delay_table))
+    else:
+        delay_table = compute_delay_table(frequencies, dm_list, int_time)
+    delay_table.flags.writeable = False
     return delay_table
 
 
 
-def incoherent_dedisp(data, delay_table):
-    n_channels = data.shape[0]
-    delay_steps = [delay_table[0, f + 1] for f in range(n_channels)]
-    return np.array([np.roll(row, -x) for row, x in zip(data, delay_steps)])
+def get_delay_table(frequencies, dm_list, int_time, cache_dir = None):
+    """
+    Cached version of compute_delay_table. Tables are kept in memory for the lifetime of the
+    process and, if `cache_dir` (or DELAY_CACHE_DIR) is set, stored on disk keyed by the
+    frequency grid, DM grid and time resolution. The returned array is read-only.
+    """
+    if cache_dir is None:
+        cache_dir = DELAY_CACHE_DIR
+    return _cached_delay_table(tuple(float(f) for f in frequencies), tuple(float(dm) for dm in dm_list),
+                               float(int_time), cache_dir)
+
+
+
+def incoherent_dedisp(data, delay_table, dm_idx = 0):
+    n_channels, n_timesteps = data.shape
+    # Channel f is shifted by the delay of its upper edge, wrapping around like np.roll.
+    delay_steps = delay_table[dm_idx, 1:n_channels + 1]
+    time_idxs = (np.arange(n_timesteps)[np.newaxis, :] + delay_steps[:, np.newaxis]) % n_timesteps
+    return np.take_along_axis(data, time_idxs, axis=1)
+
+
+
+def dm_time_plane(data, delay_table, max_block_size = 2**24):
+    """
+    Dedisperse `data` (nchan, nt) for every DM (row) in `delay_table` at once.
+
+    Row i of the returned (ndm, nt) plane is the channel-averaged, median-subtracted
+    time series, i.e. the same as compute_time_series(incoherent_dedisp(data, delay_table, i)).
+    DMs are processed in blocks so that the gather index has at most `max_block_size` elements.
+    """
+    n_channels, n_timesteps = data.shape
+    n_dms = delay_table.shape[0]
+    dm_block = max(1, max_block_size // (n_channels * n_timesteps))
+    data = data - np.nanmedian(data, axis=1)[:, np.newaxis]
+    flat_data = data.ravel()
+    # offset of the start of every channel in the flattened array
+    chan_offsets = (np.arange(n_channels) * n_timesteps)[np.newaxis, :, np.newaxis]
+    times = np.arange(n_timesteps)[np.newaxis, np.newaxis, :]
+    plane = np.empty((n_dms, n_timesteps))
+    for start in range(0, n_dms, dm_block):
+        delays = delay_table[start:start + dm_block, 1:n_channels + 1, np.newaxis]
+        idxs = chan_offsets + (times + delays) % n_timesteps
+        plane[start:start + dm_block] = np.take(flat_data, idxs).mean(axis=1)
+    return plane
+
+
+
+def dedisperse_dm_range(dyspec, frequencies, time_res, dm_list, method = "brute"):
+    delay_table = get_delay_table(frequencies, dm_list, time_res)
+    if method == "brute":
+        return dm_time_plane(dyspec, delay_table)
+    elif method == "fdmt":
+        return fdmt_dm_time_plane(dyspec, frequencies, delay_table)
+    else:
+        raise ValueError(f"Unknown dedispersion method '{method}'.")
+
 
 
+def search_dm_range(dyspec, frequencies, time_res, dm_list, widths = (1,), method = "brute"):
+    # Best (DM, SNR, width, time index) over a DM range and a set of boxcar widths.
+    plane = dedisperse_dm_range(dyspec, frequencies, time_res, dm_list, method)
+    row_snr, row_width, row_idx = boxcar_search(plane, widths)
+    best = int(np.argmax(row_snr))
+    return dm_list[best], row_snr[best], row_width[best], row_idx[best]
 
-def transform_spectrum(dyspec, frequencies, time_res, DM, channel_avg, time_avg):
+
+
+def transform_spectrum(dyspec, frequencies, time_res, DM, channel_avg, time_avg, delay_table = None):
     if DM > 0:
-        delays = compute_delay_table(frequencies, [DM], time_res)
+        delays = get_delay_table(frequencies, [DM], time_res) if delay_table is None else delay_table
         dyspec = incoherent_dedisp(dyspec, delays)
 
     dyspec = average_channels(dyspec, channel_avg)
     if time_avg > 1:
         dyspec = average_timesteps(dyspec, time_avg)
 
-    time_series = compute_time_series(dyspec)
+    # also leaves dyspec median-subtracted for plotting and for the median series
+    time_series = compute_time_series(dyspec, inplace=True)
 
     peak_idxs = peak_finding(time_series)
 
@@ -137,12 +262,170 @@ def transform_spectrum(dyspec, frequencies, time_res, DM, channel_avg, time_avg)
 
 
 
-def plot_ts_and_dynspec(fig, ds, ts, median, peak_idxs, t, freq, title = None, interp = False):
+def _read_time_window(data, start, length):
+    # Columns [start, start + length) of `data`, wrapping around the end like np.roll.
+    n_timesteps = data.shape[1]
+    start %= n_timesteps
+    pieces = []
+    while length > 0:
+        n = min(length, n_timesteps - start)
+        pieces.append(np.asarray(data[:, start:start + n]))
+        length -= n
+        start = 0
+    return np.concatenate(pieces, axis=1)
+
+
+
+def stream_spectrum(input_filename, frequencies, time_res, DM, channel_avg, time_avg, block_size = 4096, delay_table = None):
     """
-    ds   : (nchan, nt) dynamic spectrum
-    ts   : (nt,) time series
-    t    : (nt,) time array [s]
-    freq : (nchan,) frequency array [MHz]
+    Streaming version of transform_spectrum for dynamic spectra that do not fit in memory.
+
+    The FITS file is memory-mapped and read in blocks of `block_size` time steps plus an
+    overlap equal to the maximum dispersive delay. Yields (first time index, time series,
+    median series) for every block; concatenated, they match the in-memory outputs.
+    """
+    with fits.open(input_filename, memmap=True) as my_fits:
+        data = my_fits[0].data
+        n_channels, n_timesteps = data.shape
+        if n_channels % channel_avg != 0:
+            raise Exception("Averaging factor is not a multiple of the number of channels.")
+        n_groups = n_channels // channel_avg
+        if DM > 0:
+            if delay_table is None:
+                delay_table = get_delay_table(frequencies, [DM], time_res)
+            delays = delay_table[0, 1:n_channels + 1]
+        else:
+            delays = np.zeros(n_channels, dtype=int)
+        max_delay = int(delays.max())
+        # blocks must start on a time averaging boundary
+        block_size = max(time_avg, block_size - block_size % time_avg)
+
+        # The in-memory path subtracts per-channel medians, averages, then subtracts the
+        # median of every averaged channel. Both need a full row, so compute them upfront
+        # reading one channel group at a time.
+        chan_medians = np.empty(n_channels, dtype=data.dtype)
+        group_medians = np.empty(n_groups)
+        for g in range(n_groups):
+            chans = range(g * channel_avg, (g + 1) * channel_avg)
+            rows = np.array([np.roll(data[c], -delays[c]) for c in chans])
+            chan_medians[chans.start:chans.stop] = np.nanmedian(rows, axis=1)
+            group = (rows - chan_medians[chans.start:chans.stop, np.newaxis]).mean(axis=0)[np.newaxis, :]
+            if time_avg > 1:
+                group = average_timesteps(group, time_avg)
+            group_medians[g] = np.nanmedian(group)
+
+        for start in range(0, n_timesteps, block_size):
+            n_out = min(block_size, n_timesteps - start)
+            window = _read_time_window(data, start, n_out + max_delay)
+            time_idxs = np.arange(n_out)[np.newaxis, :] + delays[:, np.newaxis]
+            block = np.take_along_axis(window, time_idxs, axis=1) - chan_medians[:, np.newaxis]
+            block = block.reshape(n_groups, channel_avg, n_out).mean(axis=1)
+            if time_avg > 1:
+                block = average_timesteps(block, time_avg)
+            block -= group_medians[:, np.newaxis]
+            yield start // time_avg, block.mean(axis=0), np.median(block, axis=0)
+
+
+
+def stream_transform_spectrum(input_filename, frequencies, time_res, DM, channel_avg, time_avg, block_size = 4096, delay_table = None):
+    # Only the (1D) time and median series are kept in memory.
+    time_series, median_series = [], []
+    for _, ts_block, median_block in stream_spectrum(input_filename, frequencies, time_res, DM,
+                                                     channel_avg, time_avg, block_size, delay_table):
+        time_series.append(ts_block)
+        median_series.append(median_block)
+    time_series = np.concatenate(time_series)
+    median_series = np.concatenate(median_series)
+    return time_series, median_series, peak_finding(time_series)
+
+
+
+# Read-only state shared with the worker processes of filter_candidates.
+_filter_state = {}
+
+
+def _init_filter_worker(frequencies, delay_tables, params):
+    _filter_state["frequencies"] = frequencies
+    _filter_state["delay_tables"] = delay_tables
+    _filter_state.update(params)
+
+
+
+def filter_candidate(filename):
+    """
+    Dedisperse and peak-find one candidate dynamic spectrum, using the state set up by
+    _init_filter_worker. Returns (filename, DM, best DM, best boxcar SNR, its width, its start
+    time, number of single-sample peaks, error). The best DM is the filename DM unless a DM
+    range is searched, in which case the SNR, width and time are those of the best DM and the
+    peaks are still counted at the filename DM. A file that cannot be processed does not stop
+    the batch: its SNR and time are NaN and error holds the exception message (empty otherwise).
+    """
+    dm = best_dm = np.nan
+    try:
+        x, y, dm, offset, cand_id = extract_filename_info(os.path.basename(filename))
+        frequencies = _filter_state["frequencies"]
+        delay_table = _filter_state["delay_tables"].get(dm)
+        time_res, channel_avg, time_avg = _filter_state["time_res"], _filter_state["channel_avg"], _filter_state["time_avg"]
+        if _filter_state["stream"]:
+            time_series, median_series, peak_idxs = stream_transform_spectrum(
+                filename, frequencies, time_res, dm, channel_avg, time_avg, _filter_state["block_size"], delay_table)
+        else:
+            data = read_fits(filename)
+            dyspec, time_series, median_series, peak_idxs = transform_spectrum(
+                data, frequencies, time_res, dm, channel_avg, time_avg, delay_table)
+        if _filter_state["dm_search"] is None:
+            best_dm = dm
+            best_snr, best_width, best_idx = boxcar_search(time_series, _filter_state["widths"])
+            best_idx *= time_avg
+        else:
+            # at full time resolution, over all channels
+            best_dm, best_snr, best_width, best_idx = search_dm_range(
+                data, frequencies, time_res,
+                _filter_state["dm_search"], _filter_state["widths"], _filter_state["dm_method"])
+    except Exception as e:
+        return filename, dm, best_dm, np.nan, 0, np.nan, 0, f"{type(e).__name__}: {e}"
+    peak_time = offset + best_idx * time_res
+    return filename, dm, float(best_dm), float(best_snr), int(best_width), peak_time, len(peak_idxs), ""
+
+
+
+def filter_candidates(filenames, frequencies, time_res, channel_avg, time_avg, workers = 1, chunksize = 16, stream = False, block_size = 4096, widths = (1,),
+                      dm_search = None, dm_method = "brute"):
+    """
+    Run filter_candidate over `filenames` on a pool of `workers` processes. Delay tables are
+    computed once for every distinct DM and shipped to the workers with the frequency list.
+    If `dm_search` (a list of DMs) is given, every candidate is also searched over these DMs
+    with search_dm_range and `dm_method`; this needs the whole spectrum in memory, so it
+    cannot be combined with `stream`.
+    """
+    if stream and dm_search is not None:
+        raise ValueError("A DM range search needs the whole dynamic spectrum in memory and cannot be streamed.")
+    dm_list = sorted({extract_filename_info(os.path.basename(f))[2] for f in filenames})
+    delay_tables = {dm: np.array(get_delay_table(frequencies, [dm], time_res)) for dm in dm_list if dm > 0}
+    params = {"time_res": time_res, "channel_avg": channel_avg, "time_avg": time_avg, "stream": stream, "block_size": block_size, "widths": widths,
+              "dm_search": dm_search, "dm_method": dm_method}
+    initargs = (frequencies, delay_tables, params)
+    if workers <= 1:
+        _init_filter_worker(*initargs)
+        return [filter_candidate(f) for f in filenames]
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_filter_worker, initargs=initargs) as executor:
+        return list(executor.map(filter_candidate, filenames, chunksize=chunksize))
+
+
+
+def write_filter_summary(results, output_filename):
+    with open(output_filename, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["file", "dm", "best_dm", "snr", "width", "peak_time", "n_peaks", "error"])
+        for filename, dm, best_dm, best_snr, width, peak_time, n_peaks, error in results:
+            writer.writerow([filename, dm, best_dm, f"{best_snr:.3f}", width, f"{peak_time:.4f}", n_peaks, error])
+
+
+
+def create_plot_artists(fig, interp = False):
+    """
+    Lay out the time series, median time series and dynamic spectrum axes on `fig` and
+    create empty artists, to be filled (and refilled) by update_plot_artists.
     """
     cmap="viridis"
     gs = fig.add_gridspec(
@@ -156,106 +439,196 @@ def plot_ts_and_dynspec(fig, ds, ts, median, peak_idxs, t, freq, title = None, i
     ax_ds = fig.add_subplot(gs[2], sharex=ax_ts)
     ax_median_ts = fig.add_subplot(gs[1], sharex=ax_ts)
 
-   
     # --- Time series ---
-    ax_ts.plot(t, ts, color="k", lw=0.8)
+    ts_line, = ax_ts.plot([], [], color="k", lw=0.8)
+    peaks = ax_ts.scatter([], [], color='k')
     ax_ts.set_ylabel("Avg. intensity")
     ax_ts.tick_params(labelbottom=False)
     ax_ts.grid(alpha=0.3)
 
-    # get peaks
-    if len(peak_idxs) > 0:
-        peak_vals = [ts[i] for i in peak_idxs]
-        ax_ts.scatter([t[i] for i in peak_idxs], peak_vals, color='k')
-
     # --- Dynamic spectrum ---
-    if interp:
-        im = ax_ds.imshow(
-            ds,
-            aspect="auto",
-            origin="lower",
-            extent=[t[0], t[-1], freq[0], freq[-1]],
-            cmap=cmap
-        )
-    else:
-        im = ax_ds.imshow(
-        ds,
+    im = ax_ds.imshow(
+        np.zeros((1, 1)),
         aspect="auto",
         origin="lower",
-        extent=[t[0], t[-1], freq[0], freq[-1]],
         cmap=cmap,
-        interpolation='none'
+        interpolation=None if interp else 'none'
     )
-        
+
     # ---- Median time series ---
-    xx = np.arange(len(median))
-    ax_median_ts.plot(t, median, color='k', lw=0.8)
+    median_line, = ax_median_ts.plot([], [], color='k', lw=0.8)
     ax_median_ts.set_ylabel("Median intensity")
     ax_median_ts.grid(alpha=0.3)
     ax_median_ts.tick_params(labelbottom=False)
-    
 
     ax_ds.set_xlabel("Time (s)")
     ax_ds.set_ylabel("Frequency (MHz)")
-    if title is not None:
-        fig.suptitle(title)
+    title = fig.suptitle("")
     #cbar = fig.colorbar(im, ax=ax_ds, pad=0.01)
     #cbar.set_label("Intensity")
+    return {"ax_ts": ax_ts, "ax_median_ts": ax_median_ts, "ax_ds": ax_ds, "ts_line": ts_line, "peaks": peaks,
+            "im": im, "median_line": median_line, "title": title}
 
 
 
-def plot_spectrum(fig, dyspec, time_offset, frequencies, time_res, dm, channel_avg, time_avg, plot_title, interp):
+def update_plot_artists(artists, ds, ts, median, peak_idxs, t, freq, title = None):
+    """
+    ds   : (nchan, nt) dynamic spectrum
+    ts   : (nt,) time series
+    t    : (nt,) time array [s]
+    freq : (nchan,) frequency array [MHz]
+    """
+    t = np.asarray(t)
+    ts = np.asarray(ts)
+    artists["ts_line"].set_data(t, ts)
+    peak_idxs = np.asarray(peak_idxs, dtype=int)
+    artists["peaks"].set_offsets(np.column_stack([t[peak_idxs], ts[peak_idxs]]))
+    artists["median_line"].set_data(t, median)
+    im = artists["im"]
+    im.set_data(ds)
+    im.set_extent([t[0], t[-1], freq[0], freq[-1]])
+    im.set_clim(np.nanmin(ds), np.nanmax(ds))
+    # the x axis is shared by all the panels
+    artists["ax_ds"].set_xlim(t[0], t[-1])
+    artists["ax_ds"].set_ylim(freq[0], freq[-1])
+    for ax in [artists["ax_ts"], artists["ax_median_ts"]]:
+        ax.relim()
+        ax.autoscale_view(scalex=False)
+    artists["title"].set_text(title if title is not None else "")
+
+
+
+def plot_ts_and_dynspec(fig, ds, ts, median, peak_idxs, t, freq, title = None, interp = False):
+    """
+    ds   : (nchan, nt) dynamic spectrum
+    ts   : (nt,) time series
+    t    : (nt,) time array [s]
+    freq : (nchan,) frequency array [MHz]
+    """
+    artists = create_plot_artists(fig, interp)
+    update_plot_artists(artists, ds, ts, median, peak_idxs, t, freq, title)
+    return artists
+
+
+
+def prepare_spectrum(dyspec, time_offset, frequencies, time_res, dm, channel_avg, time_avg):
+    # Everything update_plot_artists needs, apart from the title.
     dyspec, time_series, median_series, peak_idxs = transform_spectrum(dyspec, frequencies, time_res, dm, channel_avg, time_avg)
-    plot_ts_and_dynspec(fig, dyspec, time_series, median_series, peak_idxs,
-                    [time_offset + x * time_res for x in range(len(time_series))],
-                    [x*1e3 for x in frequencies[:-1]], title=plot_title, interp=interp)
-    
+    return (dyspec, time_series, median_series, peak_idxs,
+            [time_offset + x * time_res for x in range(len(time_series))],
+            [x*1e3 for x in frequencies[:-1]])
+
+
+
+def plot_spectrum(fig, dyspec, time_offset, frequencies, time_res, dm, channel_avg, time_avg, plot_title, interp):
+    plot_ts_and_dynspec(fig, *prepare_spectrum(dyspec, time_offset, frequencies, time_res, dm, channel_avg, time_avg),
+                        title=plot_title, interp=interp)
+
+
 
+def prepare_candidate(filename, frequencies, time_res, channel_avg, time_avg):
+    x, y, dm, offset, cand_id = extract_filename_info(os.path.basename(filename))
+    plot_title = f"Candidate {cand_id} - DM {dm} - location ({x}, {y})"
+    dyspec = read_fits(filename)
+    return prepare_spectrum(dyspec, int(offset), frequencies, time_res, dm, channel_avg, time_avg), plot_title
 
 
-def process_followup_fits_list(filenames, frequencies, time_res, channel_avg, time_avg, interp, save_plots):
+
+def downsample_spectrum(dyspec, max_channels, max_timesteps):
+    # Average blocks of channels and time steps so that the spectrum is at most
+    # (max_channels, max_timesteps); the last blocks can be smaller.
+    factors = [max(1, ceil(n / m)) for n, m in zip(dyspec.shape, (max_channels, max_timesteps))]
+    for axis, factor in enumerate(factors):
+        if factor > 1:
+            starts = np.arange(0, dyspec.shape[axis], factor)
+            counts = np.diff(np.append(starts, dyspec.shape[axis]))
+            dyspec = np.add.reduceat(dyspec, starts, axis=axis, dtype=np.float64) / np.expand_dims(counts, 1 - axis)
+    return dyspec
+
+
+
+def render_candidate(filename, frequencies, time_res, channel_avg, time_avg, interp = False, dpi = 800, downsample = False):
+    """
+    Save the plot of a candidate to `<filename>_postprocessed.png` using an object-oriented
+    Agg figure, so it can run in worker processes without the pyplot state machine.
+    With `downsample`, the dynamic spectrum is averaged down to the output pixel grid first.
+    """
+    fig = Figure(figsize=(10, 6))
+    FigureCanvasAgg(fig)
+    artists = create_plot_artists(fig, interp)
+    (dyspec, *spectrum), plot_title = prepare_candidate(filename, frequencies, time_res, channel_avg, time_avg)
+    if downsample:
+        bbox = artists["ax_ds"].get_position()
+        width, height = fig.get_size_inches() * dpi * np.array([bbox.width, bbox.height])
+        dyspec = downsample_spectrum(dyspec, int(height), int(width))
+    update_plot_artists(artists, dyspec, *spectrum, title=plot_title)
+    output_filename = f"{filename}_postprocessed.png"
+    fig.savefig(output_filename, dpi=dpi)
+    return output_filename
+
 
 
+def render_candidates(filenames, frequencies, time_res, channel_avg, time_avg, interp = False, dpi = 800, downsample = False, workers = 1, chunksize = 4):
+    render = partial(render_candidate, frequencies=frequencies, time_res=time_res, channel_avg=channel_avg,
+                     time_avg=time_avg, interp=interp, dpi=dpi, downsample=downsample)
+    if workers <= 1:
+        return [render(f) for f in filenames]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(render, filenames, chunksize=chunksize))
+
+
+
+def process_followup_fits_list(filenames, frequencies, time_res, channel_avg, time_avg, interp, prefetch = 3, cache_size = 32):
+    """
+    Browse the candidates with the arrow keys. The `prefetch` candidates before and after the
+    current one are read and processed by background threads, and up to `cache_size`
+    processed candidates are kept in memory. The plot artists are created once and updated.
+    """
     fig = plt.figure(figsize=(10, 6))
+    artists = create_plot_artists(fig, interp)
     current_file_idx = 0
+    executor = ThreadPoolExecutor(max_workers=2)
+    # file index -> Future of (prepare_spectrum outputs, title), in least recently used order
+    cache = OrderedDict()
 
-    def process_fits(filename):
-        x, y, dm, offset, cand_id = extract_filename_info(filename)
-        plot_title = f"Candidate {cand_id} - DM {dm} - location ({x}, {y})"
-        dyspec = read_fits(filename)
-        plot_spectrum(fig, dyspec, int(offset), frequencies, time_res, dm, channel_avg, time_avg, plot_title, interp)
-        if save_plots:
-            plt.savefig(f"{filename}_postprocessed.png", dpi=800)
+    def request(idx):
+        if idx in cache:
+            cache.move_to_end(idx)
         else:
-            plt.show()
-        plt.close()
-    
+            cache[idx] = executor.submit(prepare_candidate, filenames[idx], frequencies, time_res, channel_avg, time_avg)
+            while len(cache) > cache_size:
+                cache.popitem(last=False)[1].cancel()
+        return cache[idx]
+
+    def show(idx):
+        spectrum, plot_title = request(idx).result()
+        update_plot_artists(artists, *spectrum, title=plot_title)
+        # prefetch the neighbours, closest first; the current candidate stays most recently used
+        for step in range(1, min(prefetch, len(filenames) // 2) + 1):
+            request((idx + step) % len(filenames))
+            request((idx - step) % len(filenames))
+        request(idx)
 
     def on_keypress(event, fig):
         nonlocal current_file_idx
-        print(event.key)
         if event.key in ["up", "pageup", "left"]:
             # go one slide backwards
-            current_file_idx -= 1
-            if current_file_idx == -1:
-                current_file_idx = len(filenames) - 1
+            current_file_idx = (current_file_idx - 1) % len(filenames)
         elif event.key in ["down", "pagedown", "right"]:
             # go forward
             current_file_idx = (current_file_idx + 1) % len(filenames)
         else:
             # command not recognised: no nothing
             return
-        
-        fig.clear()
-        process_fits(filenames[current_file_idx])
-        plt.draw()
+        show(current_file_idx)
+        fig.canvas.draw_idle()
 
-    
     fig.canvas.mpl_connect('key_press_event', lambda event: on_keypress(event, fig))
 
     # Display the initial candidate
-    process_fits(filenames[0])
+    show(current_file_idx)
     plt.show()
+    executor.shutdown(cancel_futures=True)
 
 
 
@@ -272,32 +645,91 @@ if __name__ == "__main__":
     parser.add_argument("--time-res", type=float, default=0.02, help="Time resolution in seconds.")
     parser.add_argument("--output", type=str, default="out.fits", help="Output FITS filename.")
     parser.add_argument("--interp", action='store_true', help="Enable interpolation when plotting the dynamic spectrum.")
-    parser.add_argument("--fpeaks", action='store_true', help="Only save dynamic spectra with actual peaks (SNR >= 4) in them.")
+    parser.add_argument("--fpeaks", action='store_true', help="Only save dynamic spectra whose best boxcar SNR reaches --snr-threshold.")
+    parser.add_argument("--snr-threshold", type=float, default=5, help="Minimum best boxcar SNR of the dynamic spectra saved by --fpeaks.")
     parser.add_argument("--save", action='store_true', help="Save plots instead of displaying them.")
-    parser.add_argument("FITS FILE", nargs='+', type=str, help="FITS file containing the dynamic spectrum.")
+    parser.add_argument("--dpi", type=int, default=800, help="Resolution of the plots saved with --save.")
+    parser.add_argument("--downsample", action='store_true', help="With --save, average the dynamic spectrum down to the output pixel grid before plotting.")
+    parser.add_argument("--stream", action='store_true', help="With --fpeaks, read the dynamic spectra in time blocks instead of loading them in memory.")
+    parser.add_argument("--block-size", type=int, default=4096, help="Number of time steps per block in streaming mode.")
+    parser.add_argument("--workers", type=int, default=1, help="Number of processes used to filter dynamic spectra with --fpeaks or to save plots with --save.")
+    parser.add_argument("--chunksize", type=int, default=16, help="Number of files submitted to a worker at a time with --fpeaks.")
+    parser.add_argument("--summary", type=str, default="filtered/summary.csv", help="Summary table written by --fpeaks.")
+    parser.add_argument("--widths", type=str, default="1", help="Comma-separated boxcar widths (in time bins) searched by --fpeaks; the best one sets the SNR compared to --snr-threshold.")
+    parser.add_argument("--dm-search", type=str, default=None, help="With --fpeaks, also search every candidate over the DMs min,max,step (e.g. 0,1000,5) "
+                        "and report the best DM; the SNR is then that of the best DM. Not available with --stream.")
+    parser.add_argument("--dm-method", choices=["brute", "fdmt"], default="brute", help="Dedispersion method of --dm-search.")
+    parser.add_argument("--cluster", type=str, default=None, help="Comma-separated pixel, DM and time offset radii (e.g. 2,10,5). "
+                        "Candidates closer than these are grouped and only one file per group is processed.")
+    parser.add_argument("--delay-cache", type=str, default=None, help="Directory where dispersive delay tables are cached across runs.")
+    parser.add_argument("--index", type=str, default=None, help="Candidate index (see candidate_index.py). Candidates are selected from the index "
+                        "and the positional arguments are directories to scan into it.")
+    parser.add_argument("--dm-min", type=float, default=None, help="With --index, minimum DM of the selected candidates.")
+    parser.add_argument("--dm-max", type=float, default=None, help="With --index, maximum DM of the selected candidates.")
+    parser.add_argument("--region", type=str, default=None, help="With --index, pixel region of the selected candidates as x_min,x_max,y_min,y_max.")
+    parser.add_argument("FITS FILE", nargs='*', type=str, help="FITS file containing the dynamic spectrum.")
 
     args = vars(parser.parse_args())
+    if args["stream"] and args["dm_search"] is not None:
+        parser.error("--dm-search loads the whole dynamic spectrum and cannot be combined with --stream")
+    DELAY_CACHE_DIR = args["delay_cache"]
     frequencies = compute_frequency_list_ghz(args["freq"], args["nchans"], args["chan_width"])
 
+    index = None
+    if args["index"] is not None:
+        index = open_index(args["index"])
+        for directory in args['FITS FILE']:
+            scan_directory(index, directory)
+        args['FITS FILE'] = select_candidates(index, args["dm_min"], args["dm_max"], parse_region(args["region"]))
+    if len(args['FITS FILE']) == 0:
+        print("No dynamic spectra to process.")
+        exit(0)
+
+    if args["cluster"] is not None:
+        pixel_radius, dm_radius, time_radius = (float(r) for r in args["cluster"].split(","))
+        n_files = len(args['FITS FILE'])
+        try:
+            args['FITS FILE'] = select_cluster_representatives(args['FITS FILE'], pixel_radius, dm_radius, time_radius)
+        except ValueError:
+            print("Could not parse candidate information from the filenames. This is necessary for clustering. Exiting..")
+            exit(1)
+        print(f"Clustering kept {len(args['FITS FILE'])} out of {n_files} candidates.")
+
     if args["fpeaks"]:
         if not os.path.exists("filtered"): os.mkdir("filtered")
-        for file in args['FITS FILE']:
-            try:
-                x, y, dm, offset, cand_id = extract_filename_info(file)
-            except:
-                print("Could not parse DM information from the filename. This is necessary for filtering. Exiting..")
-                exit(1)
-            dyspec = read_fits(file)
-            dyspec, time_series, median_series, peak_idxs = transform_spectrum(
-                dyspec, frequencies, args["time_res"], dm, args["chan_avg"], args["time_avg"])
-            if len(peak_idxs) > 0:
-                shutil.copy2(file, f"filtered/{file}")
+        try:
+            for file in args['FITS FILE']:
+                extract_filename_info(os.path.basename(file))
+        except:
+            print("Could not parse DM information from the filename. This is necessary for filtering. Exiting..")
+            exit(1)
+        dm_search = None
+        if args["dm_search"] is not None:
+            dm_min, dm_max, dm_step = (float(v) for v in args["dm_search"].split(","))
+            dm_search = np.arange(dm_min, dm_max + dm_step / 2, dm_step)
+        results = filter_candidates(args['FITS FILE'], frequencies, args["time_res"], args["chan_avg"], args["time_avg"],
+                                    args["workers"], args["chunksize"], args["stream"], args["block_size"],
+                                    [int(w) for w in args["widths"].split(",")], dm_search, args["dm_method"])
+        for file, dm, best_dm, best_snr, width, peak_time, n_peaks, error in results:
+            # NaN (failed files) never passes
+            if best_snr >= args["snr_threshold"]:
+                shutil.copy2(file, f"filtered/{os.path.basename(file)}")
+        write_filter_summary(results, args["summary"])
+        failed = [r for r in results if r[-1]]
+        if failed:
+            print(f"{len(failed)} out of {len(results)} files could not be processed, see {args['summary']}.")
+        if index is not None:
+            record_results(index, results)
 
     else:                
 
         try:
-            extract_filename_info(args['FITS FILE'][0])
-            process_followup_fits_list(args['FITS FILE'], frequencies, args["time_res"], args["chan_avg"], args["time_avg"], args["interp"], args["save"])
+            extract_filename_info(os.path.basename(args['FITS FILE'][0]))
+            if args["save"]:
+                render_candidates(args['FITS FILE'], frequencies, args["time_res"], args["chan_avg"], args["time_avg"], args["interp"],
+                                  args["dpi"], args["downsample"], args["workers"])
+                exit(0)
+            process_followup_fits_list(args['FITS FILE'], frequencies, args["time_res"], args["chan_avg"], args["time_avg"], args["interp"])
         except ValueError:
             # Not the standard followp filename.. use standard processing
             fig = plt.figure(figsize=(10, 6))
@@ -56,31 +56,31 @@ def peak_detection(time_series, SN = 2):
     return means, peaks
 
 
-print(dispersive_delay_ms(600, 0.138, 0.169)/1000)
-exit(0)
+if __name__ == "__main__":
+    print(dispersive_delay_ms(600, 0.138, 0.169)/1000)
+    exit(0)
 
+    background = generate_sweep(600, 135, 165, 0.01, 0.05, 12, lambda : 24)
 
-background = generate_sweep(600, 135, 165, 0.01, 0.05, 12, lambda : 24)
+    plt.imshow(background)
+    plt.show()
 
-plt.imshow(background)
-plt.show()
+    f_high_mhz = 165
+    f_low_mhz = 135
+    freq_res_mhz = 0.01
 
-f_high_mhz = 165
-f_low_mhz = 135
-freq_res_mhz = 0.01
-
-n_channels = int((f_high_mhz - f_low_mhz) / freq_res_mhz)
-freqs_ghz = np.linspace(f_low_mhz / 1000, f_high_mhz / 1000, n_channels)
+    n_channels = int((f_high_mhz - f_low_mhz) / freq_res_mhz)
+    freqs_ghz = np.linspace(f_low_mhz / 1000, f_high_mhz / 1000, n_channels)
 
-ts = dedisperse_with_dm(background, freqs_ghz, 0.05, 600)
+    ts = dedisperse_with_dm(background, freqs_ghz, 0.05, 600)
 
-tp = [i * 0.05 for i  in range(len(ts))]
+    tp = [i * 0.05 for i  in range(len(ts))]
 
 
-plt.plot(tp, ts)
+    plt.plot(tp, ts)
 
-means, peaks = peak_detection(ts)
-plt.plot(tp[:-1], means )
-peak_times = [ p * 0.05 for p in peaks]
-print(peak_times)
-plt.show()
\ No newline at end of file
+    means, peaks = peak_detection(ts)
+    plt.plot(tp[:-1], means )
+    peak_times = [ p * 0.05 for p in peaks]
+    print(peak_times)
+    plt.show()
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+
+# Tree / Fast Dispersion Measure Transform (Zackay & Ofek 2017) dedispersion.
+#
+# Uses the same conventions as dedisp_fits.py: `frequencies` are the n_channels + 1
+# channel edges in GHz in ascending order, channel c is delayed by the delay of its
+# upper edge with respect to the top of the band, and shifts wrap around like np.roll.
+# Adjacent sub-bands are merged pairwise, so all delays 0..max_delay are computed in
+# O(N_t x N_chan x log N_chan) instead of O(N_DM x N_chan x N_t).
+
+import numpy as np
+from basics import dispersive_delay_s
+
+
+def _merge_subbands(low, high, frequencies, total_max_delay, total_span):
+    # Each sub-band is (first_chan, last_chan, table) where table[d, t] is the sum of its
+    # channels dedispersed with a delay of d samples across the sub-band.
+    first_chan, mid_chan, low_table = low
+    _, last_chan, high_table = high
+    n_timesteps = low_table.shape[1]
+    # channel c sits at its upper edge, frequencies[c + 1]
+    inv_sq = np.asarray(frequencies, dtype=np.float64) ** -2
+    span = inv_sq[first_chan + 1] - inv_sq[last_chan + 1]
+    n_delays = int(np.ceil(total_max_delay * span / total_span)) + 1
+    delays = np.arange(n_delays)
+    # delay between the top of the band and the top of the low sub-band
+    low_shift = np.rint(delays * (inv_sq[mid_chan + 1] - inv_sq[last_chan + 1]) / span).astype(int)
+    high_delays = np.rint(delays * (inv_sq[mid_chan + 2] - inv_sq[last_chan + 1]) / span).astype(int)
+    low_delays = delays - low_shift
+    high_delays = np.clip(high_delays, 0, high_table.shape[0] - 1)
+    low_delays = np.clip(low_delays, 0, low_table.shape[0] - 1)
+    time_idxs = (np.arange(n_timesteps)[np.newaxis, :] + low_shift[:, np.newaxis]) % n_timesteps
+    table = high_table[high_delays] + np.take_along_axis(low_table[low_delays], time_idxs, axis=1)
+    return first_chan, last_chan, table
+
+
+def fdmt(data, frequencies, max_delay):
+    """
+    Dedisperse `data` (nchan, nt) for every integer delay 0..max_delay (in time samples)
+    between the upper edges of the lowest and highest channels.
+
+    Returns a (max_delay + 1, nt) array with the channel-summed dedispersed time series.
+    """
+    n_channels = data.shape[0]
+    if len(frequencies) != n_channels + 1:
+        raise ValueError("Expected n_channels + 1 frequency edges.")
+    inv_sq = np.asarray(frequencies, dtype=np.float64) ** -2
+    total_span = inv_sq[1] - inv_sq[-1]
+    # a single channel does not depend on the delay within it
+    subbands = [(c, c, data[c:c + 1].astype(np.float64)) for c in range(n_channels)]
+    while len(subbands) > 1:
+        merged = [_merge_subbands(subbands[i], subbands[i + 1], frequencies, max_delay, total_span)
+                  for i in range(0, len(subbands) - 1, 2)]
+        if len(subbands) % 2 == 1:
+            merged.append(subbands[-1])
+        subbands = merged
+    table = subbands[0][2]
+    if table.shape[0] < max_delay + 1:
+        table = np.broadcast_to(table, (max_delay + 1, table.shape[1])).copy()
+    return table[:max_delay + 1]
+
+
+def fdmt_delays_to_dm(frequencies, int_time, delays):
+    # delays are measured between the upper edges of the first and last channels
+    return np.asarray(delays) * int_time / dispersive_delay_s(1, frequencies[1], frequencies[-1])
+
+
+def fdmt_dm_time_plane(data, frequencies, delay_table):
+    """
+    FDMT equivalent of dedisp_fits.dm_time_plane: one row per DM in `delay_table`,
+    channel-averaged and median-subtracted. Each DM is mapped to the FDMT row with
+    the same delay across the band.
+
+    Delays are rounded to whole samples in every sub-band, so the delay applied to a channel
+    can differ from the brute-force one: by at most one sample for more than 99% of the
+    channels and DMs, and never by more than two. Part of a pulse then lands in the
+    neighbouring samples: the peak of a single-sample pulse is typically ~75% of the
+    brute-force one and can drop to ~50%, while pulses two samples wide keep more than 80%
+    and four samples wide almost all of it.
+    The position (DM and time) of the peak is the same as with the brute force.
+    """
+    n_channels = data.shape[0]
+    data = data - np.nanmedian(data, axis=1)[:, np.newaxis]
+    band_delays = delay_table[:, 1]
+    table = fdmt(data, frequencies, int(band_delays.max()))
+    return table[band_delays] / n_channels
+
+
+
+if __name__ == "__main__":
+    # Check against the brute-force dedispersion (see fdmt_dm_time_plane for the tolerances).
+    from dedispersion import generate_sweep
+    from dedisp_fits import compute_delay_table, dm_time_plane, compute_frequency_list_ghz
+
+    MAX_DELAY_ERROR = 2
+    MIN_WITHIN_ONE_SAMPLE = 0.99
+    MIN_PEAK_RATIO = 0.5
+    MIN_MEAN_PEAK_RATIO = 0.7
+    int_time = 0.02
+
+    # Delays applied to every channel: FDMT is linear and shift invariant, so an impulse at
+    # time 0 in channel c comes out of every DM row at minus the delay of that channel.
+    for n_channels, max_dm in ((16, 700), (32, 500), (64, 300)):
+        frequencies = compute_frequency_list_ghz(154.24, n_channels, 30.72 / n_channels)
+        delay_table = compute_delay_table(frequencies, np.arange(0, max_dm, 1.0), int_time)
+        band_delays = delay_table[:, 1]
+        n_timesteps = int(band_delays.max()) + 2 * MAX_DELAY_ERROR + 1
+        errors = np.empty((n_channels, len(band_delays)), dtype=np.int64)
+        for c in range(n_channels):
+            impulse = np.zeros((n_channels, n_timesteps))
+            impulse[c, 0] = 1
+            rows = fdmt(impulse, frequencies, int(band_delays.max()))[band_delays]
+            assert np.all(rows.sum(axis=1) == 1), "every channel must be added once to every DM row"
+            errors[c] = np.abs(-np.argmax(rows, axis=1) % n_timesteps - delay_table[:, c + 1])
+        within_one = np.mean(errors <= 1)
+        print(f"{n_channels} channels: channel delays at most {errors.max()} sample(s) from the brute force, "
+              f"{100 * within_one:.2f}% within one sample")
+        assert errors.max() <= MAX_DELAY_ERROR, f"{n_channels} channels: delay error {errors.max()} > {MAX_DELAY_ERROR}"
+        assert within_one >= MIN_WITHIN_ONE_SAMPLE, f"{n_channels} channels: only {100 * within_one:.2f}% within one sample"
+
+    # Peaks of dedispersed pulses: same DM and time as the brute force
+    ratios = []
+
+    def compare(data, frequencies, dm_list, label):
+        delay_table = compute_delay_table(frequencies, dm_list, int_time)
+        brute = dm_time_plane(data, delay_table)
+        tree = fdmt_dm_time_plane(data, frequencies, delay_table)
+        brute_dm, brute_t = np.unravel_index(np.argmax(brute), brute.shape)
+        tree_dm, tree_t = np.unravel_index(np.argmax(tree), tree.shape)
+        ratios.append(tree.max() / brute.max())
+        print(f"{label}: brute force peak at DM = {dm_list[brute_dm]}, t = {brute_t} - "
+              f"FDMT peak at DM = {dm_list[tree_dm]}, t = {tree_t} - ratio {ratios[-1]:.3f}")
+        assert (brute_dm, brute_t) == (tree_dm, tree_t), f"{label}: FDMT and brute force peaks differ"
+        assert ratios[-1] >= MIN_PEAK_RATIO, f"{label}: FDMT peak ratio {ratios[-1]:.3f} < {MIN_PEAK_RATIO}"
+
+    # simulated sweeps, generate_sweep stores the highest frequency in the first row
+    DM, f_low_mhz, f_high_mhz = 100, 140, 170
+    for freq_res_mhz in (0.16, 0.32):
+        sweep = generate_sweep(DM, f_low_mhz, f_high_mhz, freq_res_mhz, int_time, 1, lambda : 10)[::-1]
+        chan_freqs = np.linspace(f_low_mhz / 1000, f_high_mhz / 1000, sweep.shape[0])
+        frequencies = [chan_freqs[0] - freq_res_mhz / 1000] + list(chan_freqs)
+        compare(sweep, frequencies, np.arange(0, 2 * DM, 5.0), f"sweep, {sweep.shape[0]} channels")
+
+    # single-sample pulses on the exact brute-force delays, on top of weak noise
+    rng = np.random.default_rng(0)
+    dm_list = np.arange(0, 700, 2.0)
+    for n_channels in (16, 64):
+        frequencies = compute_frequency_list_ghz(154.24, n_channels, 30.72 / n_channels)
+        delay_table = compute_delay_table(frequencies, dm_list, int_time)
+        for dm_idx in range(25, len(dm_list), 50):
+            n_timesteps = 2 * int(delay_table[dm_idx, 0]) + 64
+            data = rng.normal(0, 0.01, (n_channels, n_timesteps))
+            data[np.arange(n_channels), (20 + delay_table[dm_idx, 1:]) % n_timesteps] += 1
+            compare(data, frequencies, dm_list, f"pulse, {n_channels} channels, DM {dm_list[dm_idx]}")
+
+    print(f"Mean peak ratio (FDMT / brute force): {np.mean(ratios):.3f}")
+    assert np.mean(ratios) >= MIN_MEAN_PEAK_RATIO, f"mean FDMT peak ratio {np.mean(ratios):.3f} < {MIN_MEAN_PEAK_RATIO}"
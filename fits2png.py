@@ -1,7 +1,14 @@
 #!/usr/bin/env python3
 
 from astropy.io import fits
+from astropy.visualization import ZScaleInterval, PercentileInterval
 import sys
+import os
+import glob
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+import numpy as np
 import matplotlib.pyplot as plt
 
 
@@ -11,7 +18,82 @@ def dump_image(input, output):
     plt.imsave(output, fits_img, cmap='gray')
 
 
+def normalise(img, scaling = "zscale", percentile = 99.5):
+    # Map the image to [0, 1] with a zscale or (central) percentile interval.
+    interval = ZScaleInterval() if scaling == "zscale" else PercentileInterval(percentile)
+    vmin, vmax = interval.get_limits(img)
+    if vmax <= vmin:
+        return np.zeros(img.shape)
+    return np.clip((img - vmin) / (vmax - vmin), 0, 1)
+
+
+def block_average(img, factor):
+    # Downsample by averaging factor x factor blocks (edges that do not fill a block are cropped).
+    ny, nx = (img.shape[0] // factor) * factor, (img.shape[1] // factor) * factor
+    return img[:ny, :nx].reshape(ny // factor, factor, nx // factor, factor).mean(axis=(1, 3))
+
+
+def export_image(input, output_dir, scaling = "zscale", percentile = 99.5, thumbnail_size = None, force = False):
+    """
+    Write `<output_dir>/<name>.png` (and `<name>_thumb.png` if `thumbnail_size` is given)
+    for one FITS image. Files whose outputs are newer than the input are skipped.
+    Returns the output file name, or None if it was skipped.
+    """
+    name = os.path.splitext(os.path.basename(input))[0]
+    output = os.path.join(output_dir, f"{name}.png")
+    thumbnail = os.path.join(output_dir, f"{name}_thumb.png")
+    outputs = [output] if thumbnail_size is None else [output, thumbnail]
+    if not force and all(os.path.exists(o) and os.path.getmtime(o) >= os.path.getmtime(input) for o in outputs):
+        return None
+    with fits.open(input, memmap=True) as my_fits:
+        fits_img = np.asarray(my_fits[0].data, dtype=np.float32)
+    fits_img = fits_img.reshape(fits_img.shape[-2:])
+    scaled = normalise(fits_img, scaling, percentile)
+    plt.imsave(output, scaled, cmap='gray', vmin=0, vmax=1)
+    if thumbnail_size is not None:
+        factor = max(1, max(scaled.shape) // thumbnail_size)
+        plt.imsave(thumbnail, block_average(scaled, factor),
+                   cmap='gray', vmin=0, vmax=1)
+    return output
+
+
+def export_images(inputs, output_dir, scaling = "zscale", percentile = 99.5, thumbnail_size = None, force = False, workers = 1):
+    """
+    Batch version of export_image. `inputs` can contain FITS files, directories (all the
+    *.fits files in them) and glob patterns.
+    """
+    filenames = []
+    for entry in inputs:
+        if os.path.isdir(entry):
+            filenames.extend(sorted(glob.glob(os.path.join(entry, "*.fits"))))
+        else:
+            filenames.extend(sorted(glob.glob(entry)) or [entry])
+    os.makedirs(output_dir, exist_ok=True)
+    export = partial(export_image, output_dir=output_dir, scaling=scaling, percentile=percentile,
+                     thumbnail_size=thumbnail_size, force=force)
+    if workers <= 1:
+        return [export(f) for f in filenames]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(export, filenames, chunksize=max(1, len(filenames) // (4 * workers))))
+
+
 if __name__ == "__main__":
-    if len(sys.argv) < 3:
-        print(f"Usage: {sys.argv[0]} <input fits> <output png>")
-    dump_image(sys.argv[1], sys.argv[2])
\ No newline at end of file
+    if len(sys.argv) == 3 and not sys.argv[1].startswith("-") and sys.argv[2].endswith(".png"):
+        # original usage: one input and one output file
+        dump_image(sys.argv[1], sys.argv[2])
+        exit(0)
+
+    parser = argparse.ArgumentParser(usage=f"{sys.argv[0]} <input fits> <output png>\n       {sys.argv[0]} [options] INPUT [INPUT ...]")
+    parser.add_argument("--output-dir", type=str, default="png", help="Directory where the PNG files are written.")
+    parser.add_argument("--scaling", choices=["zscale", "percentile"], default="zscale", help="Intensity scaling.")
+    parser.add_argument("--percentile", type=float, default=99.5, help="Central percentile kept with --scaling percentile.")
+    parser.add_argument("--thumbnail", type=int, default=None, help="Also write thumbnails about this many pixels across.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Number of images exported in parallel.")
+    parser.add_argument("--force", action='store_true', help="Export images even if the PNG is newer than the FITS file.")
+    parser.add_argument("INPUT", nargs='+', help="FITS files, directories or glob patterns.")
+    args = vars(parser.parse_args())
+
+    outputs = export_images(args["INPUT"], args["output_dir"], args["scaling"], args["percentile"],
+                            args["thumbnail"], args["force"], args["workers"])
+    n_written = sum(o is not None for o in outputs)
+    print(f"Exported {n_written} images, skipped {len(outputs) - n_written} up to date.")
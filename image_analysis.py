@@ -1,10 +1,15 @@
-import sys
+import csv
+import argparse
+from concurrent.futures import ProcessPoolExecutor
 from astropy.io import fits
 import numpy
 from statistics import mean, stdev, median, mode
 import matplotlib.pyplot as plt
 
 
+STREAMING_STATS_HEADER = ["filename", "mean", "stdev", "median", "min", "max", "p01", "p99", "n_nan"]
+
+
 def read_image(filename):
     my_fits = fits.open(filename)
     return my_fits[0].data
@@ -24,6 +29,62 @@ def process_image_list(image_list):
     return all_stats
 
 
+def streaming_image_stats(image_file, n_samples = 100000, block_rows = 256):
+    """
+    Mean, standard deviation, min and max of an image in a single pass over blocks of rows,
+    together with approximate median, 1st and 99th percentiles computed on a uniform random
+    sample of about `n_samples` pixels. NaNs are ignored and counted.
+    """
+    rng = numpy.random.default_rng(0)
+    count, total_mean, total_m2 = 0, 0.0, 0.0
+    vmin, vmax, n_nan = numpy.inf, -numpy.inf, 0
+    samples = []
+    with fits.open(image_file, memmap=True) as my_fits:
+        img = my_fits[0].data
+        img = img.reshape(-1, img.shape[-1])
+        sample_prob = min(1.0, n_samples / img.size)
+        for start in range(0, img.shape[0], block_rows):
+            block = numpy.asarray(img[start:start + block_rows], dtype=numpy.float64).ravel()
+            finite = block[numpy.isfinite(block)]
+            n_nan += block.size - finite.size
+            if finite.size == 0:
+                continue
+            # merge the block mean and sum of squared deviations (Chan et al.)
+            block_mean = finite.mean()
+            block_m2 = ((finite - block_mean) ** 2).sum()
+            delta = block_mean - total_mean
+            new_count = count + finite.size
+            total_mean += delta * finite.size / new_count
+            total_m2 += block_m2 + delta ** 2 * count * finite.size / new_count
+            count = new_count
+            vmin, vmax = min(vmin, finite.min()), max(vmax, finite.max())
+            samples.append(finite[rng.random(finite.size) < sample_prob])
+    if count == 0:
+        return (image_file, *([numpy.nan] * 7), n_nan)
+    p01, p50, p99 = numpy.percentile(numpy.concatenate(samples), [1, 50, 99])
+    return (image_file, total_mean, numpy.sqrt(total_m2 / count), p50, vmin, vmax, p01, p99, n_nan)
+
+
+def process_image_list_streaming(image_list, workers = 1, n_samples = 100000):
+    if workers <= 1:
+        return [streaming_image_stats(f, n_samples) for f in image_list]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(streaming_image_stats, image_list, [n_samples] * len(image_list),
+                                 chunksize=max(1, len(image_list) // (4 * workers))))
+
+
+def write_stats_table(stats, output_filename):
+    # Parquet (through pandas) if the file name says so, CSV otherwise.
+    if output_filename.endswith(".parquet"):
+        import pandas as pd
+        pd.DataFrame(stats, columns=STREAMING_STATS_HEADER).to_parquet(output_filename)
+        return
+    with open(output_filename, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(STREAMING_STATS_HEADER)
+        writer.writerows(stats)
+
+
 def print_stats_table(stats):
     header = ["filename", "mean", "stdev", "median", "min", "max"]
     print("{:35s} {:10s} {:10s} {:10s}".format(*header))
@@ -32,5 +93,17 @@ def print_stats_table(stats):
 
 
 if __name__ == "__main__":
-    all_stats = process_image_list(sys.argv[1:])
-    print_stats_table(all_stats)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--headless", action='store_true', help="Compute statistics in a single pass without plotting and write them to --output.")
+    parser.add_argument("--workers", type=int, default=1, help="Number of images processed in parallel in headless mode.")
+    parser.add_argument("--samples", type=int, default=100000, help="Number of pixels sampled to estimate the quantiles in headless mode.")
+    parser.add_argument("--output", type=str, default="image_stats.csv", help="Output table (.csv or .parquet) in headless mode.")
+    parser.add_argument("IMAGE", nargs='+', type=str, help="FITS images.")
+    args = vars(parser.parse_args())
+
+    if args["headless"]:
+        all_stats = process_image_list_streaming(args["IMAGE"], args["workers"], args["samples"])
+        write_stats_table(all_stats, args["output"])
+    else:
+        all_stats = process_image_list(args["IMAGE"])
+        print_stats_table(all_stats)
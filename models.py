@@ -52,10 +52,35 @@ class Dedispersion:
         self.imager = imager
     
     @property
-    def data_date(self):
+    def data_rate(self):
         return self.n_DMs * self.imager.correlator.n_intervals * self.imager.image_side ** 2 * self.imager.bits_per_pixel
 
+    # original (misspelled) name
+    data_date = data_rate
+
 
 MWA_PHASE_1 = Interferometer(128, 2, 3072, 8, 610, 2864, 1e-4)
 
-EDA2 = Interferometer(256, 2, None, None, 12000, 35, 1e-6)
\ No newline at end of file
+EDA2 = Interferometer(256, 2, None, None, 12000, 35, 1e-6)
+
+
+class Hardware:
+    """
+    Compute node: FLOP rate per core (FLOP/s), memory bandwidth, RAM, disk and network
+    throughput in bytes (per second).
+    """
+    def __init__(self, n_cores, flops_per_core, memory_bandwidth, ram, disk_throughput, network_throughput):
+        self.n_cores = n_cores
+        self.flops_per_core = flops_per_core
+        self.memory_bandwidth = memory_bandwidth
+        self.ram = ram
+        self.disk_throughput = disk_throughput
+        self.network_throughput = network_throughput
+    
+    @property
+    def flops(self):
+        return self.n_cores * self.flops_per_core
+
+
+# two 64-core AMD EPYC 7763 (single precision, 2.45 GHz x 32 FLOP/cycle), 256 GB, 100 Gb/s network
+CPU_NODE = Hardware(128, 78.4e9, 400e9, 256e9, 2e9, 12.5e9)
@@ -1,7 +1,8 @@
-from asvo import parse_asvo_results_xml
+from asvo import load_asvo_columns, columns_to_records
 import matplotlib.pyplot as plt
 from collections import defaultdict
 from bisect import bisect_left
+import numpy as np
 
 def freq_dist(results):
     centre_freqs = [x["center_frequency_mhz"] for x in results]
@@ -38,22 +39,28 @@ def freq_to_project(results):
         freq_to_count_str = " - ".join(f"Project: {p},  count: {c}" for p, c in sorted(v.items(), key=lambda y: y[0]))
         print(f"Central frequency: {x:5}, {freq_to_count_str}")
 
-def filter_project_obs(proj_id, min_dur):
+def filter_project_obs(proj_id, min_dur, policy = "after", max_gap = None):
     total = 0
 
     list_of_obs_to_save = set()
+    selected = []
     for x in results:
         pid = x["projectid"]
         duration = x["duration"]
         frq = x["center_frequency_mhz"]
         if  pid != proj_id or frq < 180 or duration < 1200: continue
         # if x["calibration"] == 0: continue
+        selected.append(x)
+    cal_ids = cal_index.find_many([x["obs_id"] for x in selected], [x["center_frequency_mhz"] for x in selected], policy, max_gap)
+
+    for x, cal_id in zip(selected, cal_ids):
+        duration = x["duration"]
+        frq = x["center_frequency_mhz"]
         obsid = x["obs_id"]
         conf = x["mwa_array_configuration"]
         # if not "Extended" in conf: continue
         bytes = x["total_archived_data_bytes"] / 1000**4
         total += bytes
-        cal_id = find_cal(obsid, cal_obs, frq)
         if cal_id == None: continue
         if cal_id['center_frequency_mhz'] != frq: raise Exception
         list_of_obs_to_save.add(obsid)
@@ -73,10 +80,76 @@ def find_cal(obsid, cals, frq):
 
 
 
+class CalibratorIndex:
+    """
+    Calibrator observations grouped by centre frequency, each group sorted by obs_id
+    (the GPS start time), so that the calibrator closest in time to an observation at the
+    same frequency is found with a binary search.
+
+    Policies: "after" (first calibrator with obs_id >= the target, like find_cal),
+    "before" (last calibrator with obs_id <= the target) and "nearest". Calibrators more
+    than `max_gap` seconds away from the target are ignored.
+    """
+
+    def __init__(self, cals):
+        by_freq = defaultdict(list)
+        for cal in cals:
+            by_freq[cal["center_frequency_mhz"]].append(cal)
+        self.cals = {}
+        self.obs_ids = {}
+        for frq, freq_cals in by_freq.items():
+            freq_cals.sort(key=lambda x: x["obs_id"])
+            self.cals[frq] = freq_cals
+            self.obs_ids[frq] = np.array([x["obs_id"] for x in freq_cals], dtype=np.int64)
+
+    def _find_idxs(self, obs_ids, frq, policy, max_gap):
+        # index in self.cals[frq] of the calibrator of every obs_id, or -1
+        cal_ids = self.obs_ids[frq]
+        n = len(cal_ids)
+        after = np.searchsorted(cal_ids, obs_ids, side="left")
+        before = np.searchsorted(cal_ids, obs_ids, side="right") - 1
+        if policy == "after":
+            idxs = np.where(after < n, after, -1)
+        elif policy == "before":
+            idxs = before
+        elif policy == "nearest":
+            after_gap = np.where(after < n, cal_ids[np.minimum(after, n - 1)] - obs_ids, np.iinfo(np.int64).max)
+            before_gap = np.where(before >= 0, obs_ids - cal_ids[np.maximum(before, 0)], np.iinfo(np.int64).max)
+            idxs = np.where(before_gap <= after_gap, before, np.where(after < n, after, -1))
+        else:
+            raise ValueError(f"Unknown calibrator policy '{policy}'.")
+        if max_gap is not None:
+            gaps = np.abs(cal_ids[np.maximum(idxs, 0)] - obs_ids)
+            idxs = np.where(gaps <= max_gap, idxs, -1)
+        return idxs
+
+    def find(self, obsid, frq, policy = "after", max_gap = None):
+        return self.find_many([obsid], [frq], policy, max_gap)[0]
+
+    def find_many(self, obsids, frqs, policy = "after", max_gap = None):
+        """
+        Calibrator (or None) for every (obsid, frequency) pair, answered one frequency at a time.
+        """
+        obsids = np.asarray(obsids, dtype=np.int64)
+        frqs = np.asarray(frqs)
+        found = [None] * len(obsids)
+        for frq in np.unique(frqs):
+            if frq not in self.cals:
+                continue
+            targets = np.flatnonzero(frqs == frq)
+            for target, idx in zip(targets, self._find_idxs(obsids[targets], frq, policy, max_gap)):
+                if idx >= 0:
+                    found[target] = self.cals[frq][idx]
+        return found
+
+
+
 if __name__ == "__main__":
     # results = parse_asvo_results_xml("data/mwaxvcs-2013-2025.xml") 
-    results = parse_asvo_results_xml("data/voltagestart-2013-2020.xml") + parse_asvo_results_xml("data/voltagestart-2020-2025.xml")
-    cal_obs = parse_asvo_results_xml("data/cal_obs.xml")
+    results = columns_to_records(load_asvo_columns("data/voltagestart-2013-2020.xml")) + \
+        columns_to_records(load_asvo_columns("data/voltagestart-2020-2025.xml"))
+    cal_obs = columns_to_records(load_asvo_columns("data/cal_obs.xml"))
+    cal_index = CalibratorIndex(cal_obs)
 
     filter_project_obs('G0024', 1000)
     # freq_to_project(results)
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+
+# Throughput and memory budget of the real-time FRB search pipeline (correlation, gridding,
+# FFT imaging and de-dispersion) on a given hardware. The data rates and de-dispersion
+# volumes come from data_rates.data_rate_sweep, the operation counts from the
+# computational_costs per-sample models scaled to FLOPs per second of observation.
+# Every stage is compute or memory-bandwidth bound (roofline), the cores of a node are
+# shared among the stages in proportion to their demand and the work is split evenly
+# across nodes (by frequency channel).
+
+from math import ceil
+from argparse import ArgumentParser
+from models import MWA_PHASE_1, CPU_NODE, Hardware
+from data_rates import data_rate_sweep
+from computational_costs import correlation_cost_per_time_sample, gridding_cost_per_time_sample, fft_cost_per_time_sample
+
+GIB = 1024**3
+
+# FLOPs of a complex multiply-add and of a complex FFT (5 N log2 N)
+CMAC_FLOPS = 8
+FFT_FLOPS = 5
+
+
+class Stage:
+    """
+    Work per second of observation: FLOPs, bytes moved to and from memory, and bytes of
+    buffers held while running.
+    """
+    def __init__(self, name, flops, memory_bytes, buffer_bytes):
+        self.name = name
+        self.flops = flops
+        self.memory_bytes = memory_bytes
+        self.buffer_bytes = buffer_bytes
+
+
+def pipeline_stages(integration_time_s, channel_avg_factor, image_side, bits_per_pixel, n_dm_trials,
+                    repr_dm = 600, bwcentre_mhz = 150, kernel_support = 7, interferometer = MWA_PHASE_1):
+    """
+    Stages of the pipeline for one configuration. Returns (stages, rates), rates being the
+    row of data_rate_sweep for the configuration (GiB/s and GiB).
+    """
+    table = data_rate_sweep(integration_time_s, channel_avg_factor, image_side, bits_per_pixel, n_dm_trials,
+                            repr_dm, bwcentre_mhz, interferometer)
+    rates = {name: float(column[0]) for name, column in table.items()}
+    samples_per_s = interferometer.sampling_freq
+    n_pols = interferometer.n_pols
+    n_channels_out = interferometer.n_channels / channel_avg_factor
+    n_pixels = image_side ** 2
+    n_intervals = 1 / integration_time_s
+    vcs, vis = rates["vcs_gibps"] * GIB, rates["visibilities_gibps"] * GIB
+    images, dedisp = rates["images_gibps"] * GIB, rates["dedisp_gibps"] * GIB
+    # complex64 uv grids, one per output channel (Stokes I)
+    grids = n_intervals * n_channels_out * n_pixels * 8
+
+    correlation = Stage("correlation",
+                        correlation_cost_per_time_sample() * samples_per_s * interferometer.n_channels * n_pols ** 2 * CMAC_FLOPS,
+                        vcs + vis, 2 * (vcs + vis) * integration_time_s)
+    gridding = Stage("gridding",
+                     gridding_cost_per_time_sample(integration_time_s) * samples_per_s * n_channels_out * n_pols
+                     * kernel_support ** 2 * CMAC_FLOPS,
+                     vis + grids, 2 * grids * integration_time_s)
+    fft = Stage("fft",
+                fft_cost_per_time_sample(n_pixels, integration_time_s) * samples_per_s * n_channels_out * FFT_FLOPS,
+                2 * grids + images, 2 * images * integration_time_s)
+    # images of the dispersive delay window and the DM-time output (data_rates.display_data_requirements)
+    dedispersion = Stage("dedispersion", n_dm_trials * n_channels_out * n_pixels * n_intervals,
+                         images + dedisp, (rates["dynspec_gib"] + rates["dmtime_gib"]) * GIB)
+    return [correlation, gridding, fft, dedispersion], rates
+
+
+def allocate_cores(demands, n_cores):
+    # At least one core per stage, the rest in proportion to the demands (largest remainder).
+    total = sum(demands)
+    spare = n_cores - len(demands)
+    shares = [spare * d / total for d in demands]
+    cores = [1 + int(x) for x in shares]
+    by_remainder = sorted(range(len(demands)), key=lambda i: shares[i] - int(shares[i]), reverse=True)
+    for i in by_remainder[:n_cores - sum(cores)]:
+        cores[i] += 1
+    return cores
+
+
+def simulate(stages, hardware : Hardware, n_nodes = 1, input_bytes = 0, output_bytes = 0):
+    """
+    Load of every stage and resource (seconds of work per second of observation on each
+    node; above 1 the pipeline falls behind real time) for the work split over `n_nodes`.
+    input_bytes and output_bytes (per second) go through the network and to disk.
+    """
+    if hardware.n_cores < len(stages):
+        raise ValueError(f"At least {len(stages)} cores are needed, one per stage.")
+    # core-seconds per second of observation of every stage: a core gets 1/n_cores of the
+    # memory bandwidth, so memory-bound stages get more cores
+    demands = [max(s.flops / hardware.flops_per_core, s.memory_bytes * hardware.n_cores / hardware.memory_bandwidth)
+               for s in stages]
+    cores = allocate_cores(demands, hardware.n_cores)
+    rows = []
+    for stage, n in zip(stages, cores):
+        compute_s = stage.flops / n_nodes / (n * hardware.flops_per_core)
+        # memory bandwidth shared in proportion to the cores
+        memory_s = stage.memory_bytes / n_nodes / (hardware.memory_bandwidth * n / hardware.n_cores)
+        rows.append({"stage": stage.name, "cores": n, "gflops": stage.flops / n_nodes / 1e9,
+                     "memory_gbps": stage.memory_bytes / n_nodes / 1e9, "compute_s": compute_s, "memory_s": memory_s,
+                     "load": max(compute_s, memory_s), "bound": "compute" if compute_s >= memory_s else "memory"})
+    io_loads = {"network": input_bytes / n_nodes / hardware.network_throughput,
+                "disk": output_bytes / n_nodes / hardware.disk_throughput}
+    peak_memory = sum(s.buffer_bytes for s in stages) / n_nodes
+    loads = {r["stage"]: r["load"] for r in rows}
+    loads.update(io_loads)
+    bottleneck = max(loads, key=loads.get)
+    return {
+        "nodes": n_nodes,
+        "stages": rows,
+        "io": io_loads,
+        "peak_memory_bytes": peak_memory,
+        "bottleneck": bottleneck,
+        "real_time": loads[bottleneck] <= 1 and peak_memory <= hardware.ram,
+        # loads and memory scale as 1/n_nodes
+        "nodes_needed": max(1, ceil(loads[bottleneck] * n_nodes), ceil(peak_memory * n_nodes / hardware.ram)),
+    }
+
+
+def print_report(result, hardware):
+    print(f"Pipeline on {result['nodes']} node(s) of {hardware.n_cores} cores\n=========================================\n")
+    print(f"{'stage':14s} {'cores':>5s} {'GFLOP/s':>10s} {'mem GB/s':>9s} {'load':>7s} bound")
+    for r in result["stages"]:
+        print(f"{r['stage']:14s} {r['cores']:5d} {r['gflops']:10.1f} {r['memory_gbps']:9.2f} {r['load']:7.3f} {r['bound']}")
+    for name, load in result["io"].items():
+        print(f"{name:14s} {'':5s} {'':10s} {'':9s} {load:7.3f} I/O")
+    print(f"\nPeak buffer memory per node: {result['peak_memory_bytes'] / GIB:.2f} GiB (RAM {hardware.ram / GIB:.2f} GiB)")
+    print(f"Bottleneck: {result['bottleneck']}")
+    print(f"Real time: {'yes' if result['real_time'] else 'no'} - nodes needed: {result['nodes_needed']}")
+
+
+if __name__ == "__main__":
+
+    parser = ArgumentParser()
+    parser.add_argument("--inttime", "-t", type=float, required=True, help="Integration time (in seconds).")
+    parser.add_argument("--avg", "-c", required=True, type=int, help="Fine channel averaging factor.")
+    parser.add_argument("--imageside", "-s", type=int, required=True, help="Image side size.")
+    parser.add_argument("--bpp", "-b", type=int, default=32, help="Bits used to represent an image pixel.")
+    parser.add_argument("--dmtrials", "-d", required=True, type=int, help="Number of DM trials.")
+    parser.add_argument("--bwcentre", type=float, default=150, help="Centre of the 30.72MHz MWA bandwidth (in MHz).")
+    parser.add_argument("--dm", type=float, default=600, help="Representative DM used to compute the dispersive delay (in pc cm-3).")
+    parser.add_argument("--kernel", type=int, default=7, help="Gridding kernel support (pixels).")
+    parser.add_argument("--store", choices=["none", "images", "dmtime"], default="none", help="Data product written to disk.")
+    parser.add_argument("--nodes", type=int, default=1, help="Number of nodes sharing the work.")
+    parser.add_argument("--cores", type=int, default=CPU_NODE.n_cores, help="Cores per node.")
+    parser.add_argument("--gflops", type=float, default=CPU_NODE.flops_per_core / 1e9, help="GFLOP/s per core.")
+    parser.add_argument("--membw", type=float, default=CPU_NODE.memory_bandwidth / 1e9, help="Memory bandwidth per node (GB/s).")
+    parser.add_argument("--ram", type=float, default=CPU_NODE.ram / 1e9, help="RAM per node (GB).")
+    parser.add_argument("--disk", type=float, default=CPU_NODE.disk_throughput / 1e9, help="Disk write throughput per node (GB/s).")
+    parser.add_argument("--network", type=float, default=CPU_NODE.network_throughput / 1e9, help="Network input throughput per node (GB/s).")
+    args = vars(parser.parse_args())
+
+    hardware = Hardware(args["cores"], args["gflops"] * 1e9, args["membw"] * 1e9, args["ram"] * 1e9,
+                        args["disk"] * 1e9, args["network"] * 1e9)
+    stages, rates = pipeline_stages(args["inttime"], args["avg"], args["imageside"], args["bpp"], args["dmtrials"],
+                                    args["dm"], args["bwcentre"], args["kernel"])
+    output_bytes = {"none": 0, "images": rates["images_gibps"], "dmtime": rates["dedisp_gibps"]}[args["store"]] * GIB
+    result = simulate(stages, hardware, args["nodes"], rates["vcs_gibps"] * GIB, output_bytes)
+    print_report(result, hardware)
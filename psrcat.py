@@ -4,18 +4,53 @@ from __future__ import annotations
 
 import io
 import re
-from typing import Any, Dict, Iterable, Optional, Tuple, Union
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from html import unescape
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+import numpy as np
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import pandas as pd
 from bs4 import BeautifulSoup
 import argparse
+from psrcat_local import LocalPulsarCatalogue
 
 
 ATNF_PROC_FORM_URL = "https://www.atnf.csiro.au/research/pulsar/psrcat/proc_form.php"
 
+# Query parameters of a cone search returning Name, JName and DM; see cone_search_params.
+CONE_SEARCH_PARAMS = {
+    "version": "2.7.0",
+    "Name": "Name",
+    "JName": "JName",
+    "DM": "DM",
+    "startUserDefined": "true",
+    "sort_attr": "jname",
+    "sort_order": "asc",
+    "condition": "",
+    "coords_unit": "rajd/decjd",
+    "pulsar_names": "",
+    "ephemeris": "short",
+    "style": "long with last digit error",
+    "no_value": "*",
+    "fsize": "3",
+    "x_axis": "",
+    "x_scale": "linear",
+    "y_axis": "",
+    "y_scale": "linear",
+    "state": "query",
+}
+
 
 _REF_BRACKET_RE = re.compile(r"【\d+†[^】]+】")
-_MULTI_WS_RE = re.compile(r"[ \t]+")
+_TOKEN_RE = re.compile(r"\S+")
+_TAG_RE = re.compile(r"<[^>]*>")
 
 
 def query_atnf_psrcat(
@@ -65,84 +100,288 @@ def query_atnf_psrcat(
     resp.raise_for_status()
 
     # The endpoint typically returns HTML even for "csv" styles; table content is inside it.
-    html = resp.text
-    soup = BeautifulSoup(html, "html.parser").pre
-    text = soup.text
+    text = _extract_pre_text(resp.text)
     # Try CSV first (semicolon-separated is typical for ATNF "short csv ..." output).
     df = _parse_plaintext_table(text)
     return df
 
 
+def cone_search_params(ra_deg: float, dec_deg: float, radius_deg: float, **overrides: Any) -> Dict[str, str]:
+    """
+    proc_form.php parameters of a cone search of radius `radius_deg` around (ra_deg, dec_deg).
+    """
+    params = dict(CONE_SEARCH_PARAMS, radius=str(radius_deg), coords_1=str(ra_deg), coords_2=str(dec_deg))
+    params.update(overrides)
+    return params
+
 
-def _parse_plaintext_table(extracted_text: str) -> pd.DataFrame:
+def _extract_pre_text(html: str) -> str:
+    """
+    Text of the first <pre> block. The block is located with plain string searches and
+    only its content is unescaped; BeautifulSoup is the fallback for unusual markup.
+    """
+    lower = html.lower()
+    start = lower.find("<pre")
+    start = -1 if start < 0 else lower.find(">", start) + 1
+    end = lower.find("</pre>", start) if start > 0 else -1
+    if start > 0 and end >= 0:
+        content = html[start:end]
+        if "<" in content:
+            # links around reference codes and similar inline markup
+            content = _TAG_RE.sub("", content)
+        return unescape(content)
+    pre = BeautifulSoup(html, "html.parser").pre
+    if pre is None:
+        raise ValueError("Could not find a <pre> block in the response.")
+    return pre.text
+
+
+def _normalize_value(value: Any) -> str:
+    # "1", "1.0" and 1.0 must give the same cache key
+    text = str(value).strip()
+    try:
+        return repr(float(text))
+    except ValueError:
+        return text
+
+
+def normalize_query_params(query_params: Dict[str, Any]) -> str:
+    """
+    Canonical form of a query (sorted keys, stripped values, numbers in a single format),
+    used as the cache key.
+    """
+    return json.dumps({str(k).strip(): _normalize_value(v) for k, v in query_params.items()}, sort_keys=True)
+
+
+class ResponseCache:
+    """
+    Persistent cache of the <pre> table text returned for each query, stored in SQLite and
+    keyed by the endpoint and the normalized query parameters. Entries older than `ttl_s`
+    seconds are ignored (and replaced on the next fetch). Safe to share between threads.
+    """
+
+    def __init__(self, filename: str, ttl_s: Optional[float] = 7 * 24 * 3600):
+        self.ttl_s = ttl_s
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(filename, check_same_thread=False)
+        with self._db:
+            self._db.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, created REAL, text TEXT)")
+
+    @staticmethod
+    def key(base_url: str, query_params: Dict[str, Any]) -> str:
+        return hashlib.sha256((base_url + "?" + normalize_query_params(query_params)).encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._db.execute("SELECT created, text FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is None or (self.ttl_s is not None and time.time() - row[0] > self.ttl_s):
+            return None
+        return row[1]
+
+    def put(self, key: str, text: str) -> None:
+        with self._lock, self._db:
+            self._db.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?)", (key, time.time(), text))
+
+    def close(self) -> None:
+        self._db.close()
+
+
+class PsrcatClient:
+    """
+    ATNF pulsar catalogue client reusing pooled HTTP connections, retrying failed requests
+    with exponential backoff and caching the responses on disk.
+
+    Parameters
+    ----------
+    base_url:
+        Endpoint URL (default is ATNF proc_form.php); point it to a local server for testing.
+    cache_path:
+        SQLite file of the response cache, or None to disable caching.
+    ttl_s:
+        Time to live of the cached responses (seconds), None for no expiry.
+    max_workers:
+        Number of concurrent requests of the batch methods (and size of the connection pool).
+    retries, backoff_factor:
+        Retries of connection errors and 429/5xx responses, with a sleep of
+        backoff_factor * 2**(retry - 1) seconds between attempts.
+    """
+
+    def __init__(
+        self,
+        base_url: str = ATNF_PROC_FORM_URL,
+        *,
+        cache_path: Optional[str] = None,
+        ttl_s: Optional[float] = 7 * 24 * 3600,
+        max_workers: int = 8,
+        retries: int = 3,
+        backoff_factor: float = 0.5,
+        timeout: Union[float, Tuple[float, float]] = (10.0, 60.0),
+        user_agent: str = "python-requests (contact: you@example.com)",
+    ):
+        self.base_url = base_url
+        self.timeout = timeout
+        self.max_workers = max_workers
+        self.cache = None if cache_path is None else ResponseCache(cache_path, ttl_s)
+        retry = Retry(total=retries, backoff_factor=backoff_factor, status_forcelist=(429, 500, 502, 503, 504),
+                      allowed_methods=("GET",))
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers, max_retries=retry)
+        self.session = requests.Session()
+        self.session.headers["User-Agent"] = user_agent
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def fetch_text(self, query_params: Dict[str, Any]) -> str:
+        """
+        Text of the <pre> table returned for `query_params`, from the cache if possible.
+        """
+        key = None
+        if self.cache is not None:
+            key = ResponseCache.key(self.base_url, query_params)
+            text = self.cache.get(key)
+            if text is not None:
+                return text
+        resp = self.session.get(self.base_url, params=query_params, timeout=self.timeout)
+        resp.raise_for_status()
+        text = _extract_pre_text(resp.text)
+        if key is not None:
+            self.cache.put(key, text)
+        return text
+
+    def query(self, query_params: Dict[str, Any]) -> pd.DataFrame:
+        return _parse_plaintext_table(self.fetch_text(query_params))
+
+    def query_many(self, queries: Sequence[Dict[str, Any]]) -> List[pd.DataFrame]:
+        """
+        Results of several queries, in order, resolved concurrently by at most
+        `max_workers` threads.
+        """
+        if len(queries) <= 1 or self.max_workers <= 1:
+            return [self.query(q) for q in queries]
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return list(executor.map(self.query, queries))
+
+    def cone_search(self, ra_deg: float, dec_deg: float, radius_deg: float) -> pd.DataFrame:
+        return self.query(cone_search_params(ra_deg, dec_deg, radius_deg))
+
+    def cone_search_many(self, positions: Iterable[Tuple[float, float]], radius_deg: float) -> List[pd.DataFrame]:
+        return self.query_many([cone_search_params(ra, dec, radius_deg) for ra, dec in positions])
+
+    def close(self) -> None:
+        self.session.close()
+        if self.cache is not None:
+            self.cache.close()
+
+    def __enter__(self) -> "PsrcatClient":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
+
+
+
+def _is_dashed(line: str) -> bool:
+    s2 = line.strip()
+    return len(s2) >= 5 and not s2.strip("- ")
+
+
+def _last_digit_error(value: str, error: str) -> float:
+    """
+    Absolute error of a "last digit error" pair: the error applies to the last digit of
+    the value, e.g. ("10.922", "6") -> 0.006, ("1.25e-15", "3") -> 3e-17, ("00:34:08.8", "3") -> 0.3.
+    """
+    mantissa, _, exponent = value.lower().partition("e")
+    decimals = len(mantissa.rsplit(".", 1)[1]) if "." in mantissa else 0
+    try:
+        scale = int(exponent) if exponent else 0
+    except ValueError:
+        scale = 0
+    return int(error) * 10.0 ** (scale - decimals)
+
+
+def _typed_column(values: List[Optional[str]]) -> Union[np.ndarray, List[Optional[str]]]:
+    # float64 with NaN for missing values if every value is numeric, strings otherwise
+    try:
+        return np.array([np.nan if v is None else float(v) for v in values], dtype=np.float64)
+    except ValueError:
+        return values
+
+
+def _parse_plaintext_table(extracted_text: str, with_refs: bool = False) -> pd.DataFrame:
     """
     Parse the text table rendered in the HTML output.
 
     Looks for:
         dashed rule
         header line starting with '#'
+        (unit lines)
         dashed rule
         numbered rows
         dashed rule
 
-    Cleans ATNF's bracketed reference markers like: 
+    Rows are cut at the positions where the header names start, so every requested
+    column is kept. Within a column the tokens are value [error] [reference]; "*" is a
+    missing value and an all-digits token after the value is its last-digit error (see
+    _last_digit_error). Numeric columns become float arrays. Columns with errors get a
+    "<NAME>_ERR" column, and "<NAME>_REF" columns are added if `with_refs`.
     """
-    # Clean bracketed reference markers and normalize whitespace
-    cleaned = _REF_BRACKET_RE.sub("", extracted_text).replace("\xa0", " ")
-    lines = [ln.rstrip() for ln in cleaned.splitlines() if ln.strip()]
-
-    # Locate a header line (starts with '#') and dashed separators nearby
-    header_i = None
-    for i, ln in enumerate(lines):
-        if ln.lstrip().startswith("#"):
-            header_i = i
-            break
-    if header_i is None:
-        raise ValueError("Could not find a header line (starting with '#') in the response.")
-
-    # Column names: split header after '#'
-    header_line = lines[header_i].lstrip()[1:].strip()
-    colnames = [c for c in _MULTI_WS_RE.split(header_line) if c]
-
-    # Data usually begins after the next dashed rule following the header
-    def is_dashed(s: str) -> bool:
-        s2 = s.strip()
-        return len(s2) >= 5 and set(s2) <= {"-", " "}
-
-    start = None
-    for j in range(header_i + 1, len(lines)):
-        if is_dashed(lines[j]):
-            start = j + 1
-            break
-
-    # Read rows until the next dashed rule or footer.
-    rows = []
-    for ln in lines[start:]:
-        if is_dashed(ln):
-            break
-        if ln.strip().upper().startswith("PLEASE READ"):
-            break
-
-        # Normalize whitespace
-        ln2 = _MULTI_WS_RE.sub(" ", ln.strip())
-
-        # Expect leading row index like "1 ..."
-        parts = ln2.split(" ")
-        if not parts or not parts[0].isdigit():
+    if "【" in extracted_text:
+        extracted_text = _REF_BRACKET_RE.sub("", extracted_text)
+    extracted_text = extracted_text.replace("\xa0", " ")
+
+    colnames, starts, bounds = None, None, None
+    values, errors, refs = None, None, None
+    in_rows = False
+    for ln in extracted_text.splitlines():
+        if colnames is None:
+            if ln.lstrip().startswith("#"):
+                header = [(m.start(), m.group()) for m in _TOKEN_RE.finditer(ln)]
+                if header[0][1] != "#":
+                    # "#NAME ..."
+                    header.insert(1, (header[0][0] + 1, header[0][1][1:]))
+                # first token is the '#' of the row numbers
+                starts = [pos for pos, _ in header[1:]]
+                bounds = list(zip(starts, starts[1:] + [None]))
+                colnames = [name for _, name in header[1:]]
+                values = [[] for _ in colnames]
+                errors = [[] for _ in colnames]
+                refs = [[] for _ in colnames]
             continue
+        if not in_rows:
+            # the data begins after the next dashed rule following the header
+            in_rows = _is_dashed(ln)
+            continue
+        # expect leading row index like "1 ..."
+        if not ln[:starts[0]].strip().isdigit():
+            if _is_dashed(ln) or ln.strip().upper().startswith("PLEASE READ"):
+                break
+            continue
+        for c, field in enumerate(ln[a:b].split() for a, b in bounds):
+            value = field[0] if field and field[0] != "*" else None
+            rest = field[1:]
+            error = None
+            if value is not None and rest and rest[0].isdigit():
+                error = _last_digit_error(value, rest[0])
+                rest = rest[1:]
+            elif rest and rest[0] == "*":
+                # missing error
+                rest = rest[1:]
+            values[c].append(value)
+            errors[c].append(np.nan if error is None else error)
+            if with_refs:
+                refs[c].append(" ".join(rest) if rest else None)
+
+    if colnames is None:
+        raise ValueError("Could not find a header line (starting with '#') in the response.")
 
-        # Drop the leading row number
-        parts = parts[1:]
-
-        # Heuristic: Some styles include +/- error columns. If we have more fields than colnames,
-        # keep the leftmost len(colnames) fields (common for link-duplication artifacts).
-        # if len(parts) >= len(colnames):
-        #     parts = parts[: len(colnames)]
-        #     rows.append(parts)
-        # Name PSRJ DM
-        rows.append([parts[0], parts[2], parts[4]])
-
-    return pd.DataFrame(rows, columns=colnames)
+    columns = {}
+    for c, name in enumerate(colnames):
+        columns[name] = _typed_column(values[c])
+        err = np.array(errors[c], dtype=np.float64)
+        if np.isfinite(err).any():
+            columns[f"{name}_ERR"] = err
+        if with_refs:
+            columns[f"{name}_REF"] = refs[c]
+    return pd.DataFrame(columns)
 
 
 # ------------------- Example usage -------------------
@@ -151,39 +390,34 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser()
 
     parser.add_argument("--radius", type=float, default=1.0, help="Radius (in degrees) or the search area defined by the coordinates.")
-    parser.add_argument("COORDINATES", nargs="+", help="Whitespace-delimited oordinates, in degrees, defining the centre of the search area.")
+    parser.add_argument("--url", type=str, default=ATNF_PROC_FORM_URL, help="Catalogue endpoint.")
+    parser.add_argument("--cache", type=str, default=None, help="SQLite file caching the responses.")
+    parser.add_argument("--ttl", type=float, default=7 * 24 * 3600, help="Time to live of the cached responses (seconds).")
+    parser.add_argument("--workers", type=int, default=8, help="Number of concurrent queries.")
+    parser.add_argument("--local", type=str, default=None, help="Search this catalogue dump (see psrcat_local.py) instead of querying the ATNF server.")
+    parser.add_argument("--dm-min", type=float, default=None, help="Minimum DM of the returned pulsars (with --local).")
+    parser.add_argument("--dm-max", type=float, default=None, help="Maximum DM of the returned pulsars (with --local).")
+    parser.add_argument("COORDINATES", nargs="+", help="Whitespace-delimited oordinates, in degrees, defining the centre of the search area. "
+                        "Several centres can be given as RA1 DEC1 RA2 DEC2 ...")
 
     args = vars(parser.parse_args())
-
-    params = {
-        "version": "2.7.0",
-        "Name": "Name",
-        "JName": "JName",
-        "DM": "DM",
-        "startUserDefined": "true",
-        "sort_attr": "jname",
-        "sort_order": "asc",
-        "condition": "",
-        "coords_unit": "rajd/decjd",
-        "radius": str(args["radius"]),
-        "coords_1": str(args["COORDINATES"][0]),
-        "coords_2": str(args["COORDINATES"][1]),
-        "pulsar_names": "",
-        "ephemeris": "short",
-        "style": "long with last digit error",
-        "no_value": "*",
-        "fsize": "3",
-        "x_axis": "",
-        "x_scale": "linear",
-        "y_axis": "",
-        "y_scale": "linear",
-        "state": "query",
-    }
-
-    df = query_atnf_psrcat(params)
-
-    print("==============================")
-    print("Number of results:", len(df))
-    print("==============================")
-    if len(df) > 0:
-        print(df)
+    if len(args["COORDINATES"]) % 2 != 0:
+        parser.error("coordinates must be given as RA DEC pairs")
+    positions = list(zip(args["COORDINATES"][::2], args["COORDINATES"][1::2]))
+
+    if args["local"] is not None:
+        catalogue = LocalPulsarCatalogue.from_file(args["local"])
+        results = catalogue.cone_search_many([(float(ra), float(dec)) for ra, dec in positions], args["radius"],
+                                             args["dm_min"], args["dm_max"])
+    else:
+        with PsrcatClient(args["url"], cache_path=args["cache"], ttl_s=args["ttl"], max_workers=args["workers"]) as client:
+            results = client.cone_search_many(positions, args["radius"])
+
+    for (ra, dec), df in zip(positions, results):
+        print("==============================")
+        if len(positions) > 1:
+            print(f"Centre: {ra} {dec}")
+        print("Number of results:", len(df))
+        print("==============================")
+        if len(df) > 0:
+            print(df)
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+
+# Offline pulsar catalogue for cone searches without network access. A catalogue dump
+# (delimited text with a header line, e.g. the ATNF "short csv" output or a pandas CSV) is
+# loaded once, the positions are stored as unit vectors in a KD-tree and cone searches
+# become radius queries on the tree, optionally restricted to a DM window.
+
+from __future__ import annotations
+
+import argparse
+from typing import Iterable, List, Optional, Sequence, Tuple
+import numpy as np
+import pandas as pd
+from scipy.spatial import cKDTree
+
+
+# Accepted (case-insensitive) column names, in order of preference.
+_NAME_COLUMNS = ("PSRJ", "JNAME", "NAME", "PSRB")
+_RA_DEG_COLUMNS = ("RAJD", "RA_DEG", "RA")
+_DEC_DEG_COLUMNS = ("DECJD", "DEC_DEG", "DEC")
+_RA_HMS_COLUMNS = ("RAJ",)
+_DEC_DMS_COLUMNS = ("DECJ",)
+
+
+def _find_column(table: pd.DataFrame, candidates: Sequence[str]) -> Optional[str]:
+    upper = {c.strip().upper(): c for c in table.columns}
+    for name in candidates:
+        if name in upper:
+            return upper[name]
+    return None
+
+
+def sexagesimal_to_deg(values: Iterable[str], hours: bool = False) -> np.ndarray:
+    """
+    Convert "dd:mm:ss.s" (or "hh:mm:ss.s" if `hours`) strings to degrees; missing fields
+    count as zero and unparsable values become NaN.
+    """
+    result = []
+    for value in values:
+        try:
+            text = str(value).strip()
+            sign = -1.0 if text.startswith("-") else 1.0
+            fields = [float(f) for f in text.lstrip("+-").split(":")] + [0.0, 0.0]
+            deg = sign * (fields[0] + fields[1] / 60 + fields[2] / 3600)
+            result.append(deg * 15 if hours else deg)
+        except ValueError:
+            result.append(np.nan)
+    return np.array(result, dtype=np.float64)
+
+
+def radec_to_unit_vectors(ra_deg: np.ndarray, dec_deg: np.ndarray) -> np.ndarray:
+    ra, dec = np.radians(ra_deg), np.radians(dec_deg)
+    cos_dec = np.cos(dec)
+    return np.stack([cos_dec * np.cos(ra), cos_dec * np.sin(ra), np.sin(dec)], axis=-1)
+
+
+def _chord(radius_deg: float) -> float:
+    # straight-line distance between two unit vectors separated by radius_deg
+    return 2 * np.sin(np.radians(min(radius_deg, 180.0)) / 2)
+
+
+class LocalPulsarCatalogue:
+    """
+    Pulsar catalogue held in memory with a KD-tree on the unit vectors of the positions.
+
+    Parameters
+    ----------
+    table:
+        One row per pulsar; returned (with an added SEP_DEG column) by the cone searches.
+    ra_deg, dec_deg, dm:
+        Arrays aligned with the rows of `table`. Pulsars without position are never
+        returned; pulsars without DM (NaN) are dropped when a DM window is given.
+    """
+
+    def __init__(self, table: pd.DataFrame, ra_deg: np.ndarray, dec_deg: np.ndarray, dm: np.ndarray):
+        self.table = table.reset_index(drop=True)
+        self.ra_deg = np.asarray(ra_deg, dtype=np.float64)
+        self.dec_deg = np.asarray(dec_deg, dtype=np.float64)
+        self.dm = np.asarray(dm, dtype=np.float64)
+        self._rows = np.flatnonzero(np.isfinite(self.ra_deg) & np.isfinite(self.dec_deg))
+        self._vectors = radec_to_unit_vectors(self.ra_deg[self._rows], self.dec_deg[self._rows])
+        self._tree = cKDTree(self._vectors)
+
+    @classmethod
+    def from_table(cls, table: pd.DataFrame) -> "LocalPulsarCatalogue":
+        ra_col, dec_col = _find_column(table, _RA_DEG_COLUMNS), _find_column(table, _DEC_DEG_COLUMNS)
+        if ra_col is not None and dec_col is not None:
+            ra_deg = pd.to_numeric(table[ra_col], errors="coerce").to_numpy(dtype=np.float64)
+            dec_deg = pd.to_numeric(table[dec_col], errors="coerce").to_numpy(dtype=np.float64)
+        else:
+            ra_col, dec_col = _find_column(table, _RA_HMS_COLUMNS), _find_column(table, _DEC_DMS_COLUMNS)
+            if ra_col is None or dec_col is None:
+                raise ValueError("The catalogue needs RAJD/DECJD (degrees) or RAJ/DECJ (sexagesimal) columns.")
+            ra_deg = sexagesimal_to_deg(table[ra_col], hours=True)
+            dec_deg = sexagesimal_to_deg(table[dec_col])
+        dm_col = _find_column(table, ("DM",))
+        dm = np.full(len(table), np.nan) if dm_col is None else \
+            pd.to_numeric(table[dm_col], errors="coerce").to_numpy(dtype=np.float64)
+        return cls(table, ra_deg, dec_deg, dm)
+
+    @classmethod
+    def from_file(cls, filename: str) -> "LocalPulsarCatalogue":
+        """
+        Load a delimited text dump with a header line (separator detected automatically,
+        "*" marks missing values as in the ATNF output).
+        """
+        table = pd.read_csv(filename, sep=None, engine="python", na_values=["*"], skipinitialspace=True)
+        table.columns = [str(c).strip() for c in table.columns]
+        # drop unnamed columns left by trailing separators
+        table = table.loc[:, [not c.startswith("Unnamed:") for c in table.columns]]
+        return cls.from_table(table)
+
+    def __len__(self) -> int:
+        return len(self.table)
+
+    def cone_search_indices(
+        self,
+        positions: Sequence[Tuple[float, float]],
+        radius_deg: float,
+        dm_min: Optional[float] = None,
+        dm_max: Optional[float] = None,
+    ) -> List[np.ndarray]:
+        """
+        For every (ra_deg, dec_deg) position, the sorted table rows within `radius_deg`
+        and with DM in [dm_min, dm_max] (None disables a bound).
+        """
+        positions = np.asarray(positions, dtype=np.float64).reshape(-1, 2)
+        centres = radec_to_unit_vectors(positions[:, 0], positions[:, 1])
+        matches = self._tree.query_ball_point(centres, _chord(radius_deg), return_sorted=True)
+        results = []
+        for match in matches:
+            rows = self._rows[np.asarray(match, dtype=np.int64)]
+            if dm_min is not None:
+                rows = rows[self.dm[rows] >= dm_min]
+            if dm_max is not None:
+                rows = rows[self.dm[rows] <= dm_max]
+            results.append(rows)
+        return results
+
+    def separation_deg(self, rows: np.ndarray, ra_deg: float, dec_deg: float) -> np.ndarray:
+        centre = radec_to_unit_vectors(np.array([ra_deg]), np.array([dec_deg]))[0]
+        vectors = radec_to_unit_vectors(self.ra_deg[rows], self.dec_deg[rows])
+        return np.degrees(np.arccos(np.clip(vectors @ centre, -1.0, 1.0)))
+
+    def cone_search(self, ra_deg: float, dec_deg: float, radius_deg: float,
+                    dm_min: Optional[float] = None, dm_max: Optional[float] = None) -> pd.DataFrame:
+        return self.cone_search_many([(ra_deg, dec_deg)], radius_deg, dm_min, dm_max)[0]
+
+    def cone_search_many(self, positions: Sequence[Tuple[float, float]], radius_deg: float,
+                         dm_min: Optional[float] = None, dm_max: Optional[float] = None) -> List[pd.DataFrame]:
+        """
+        Rows of the catalogue in each cone (plus their separation SEP_DEG from the centre),
+        in the same order as `positions`.
+        """
+        positions = np.asarray(positions, dtype=np.float64).reshape(-1, 2)
+        results = []
+        for (ra, dec), rows in zip(positions, self.cone_search_indices(positions, radius_deg, dm_min, dm_max)):
+            df = self.table.iloc[rows].reset_index(drop=True)
+            df["SEP_DEG"] = self.separation_deg(rows, ra, dec)
+            results.append(df)
+        return results
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--radius", type=float, default=1.0, help="Radius (in degrees) of the search area.")
+    parser.add_argument("--dm-min", type=float, default=None, help="Minimum DM of the returned pulsars.")
+    parser.add_argument("--dm-max", type=float, default=None, help="Maximum DM of the returned pulsars.")
+    parser.add_argument("CATALOGUE", type=str, help="Catalogue dump (delimited text with a header line).")
+    parser.add_argument("COORDINATES", nargs="+", type=float, help="RA DEC pairs, in degrees, of the centres of the search areas.")
+    args = vars(parser.parse_args())
+    if len(args["COORDINATES"]) % 2 != 0:
+        parser.error("coordinates must be given as RA DEC pairs")
+
+    catalogue = LocalPulsarCatalogue.from_file(args["CATALOGUE"])
+    positions = list(zip(args["COORDINATES"][::2], args["COORDINATES"][1::2]))
+    for (ra, dec), df in zip(positions, catalogue.cone_search_many(positions, args["radius"], args["dm_min"], args["dm_max"])):
+        print(f"Centre: {ra} {dec} - {len(df)} pulsars")
+        if len(df) > 0:
+            print(df)
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+
+# Robust statistics for peak finding on (dedispersed) time series.
+# Quantiles are computed with np.partition in O(n) and, as in dedisp_fits.compute_iqr,
+# they are the element at index int(n * q) of the sorted values (no interpolation).
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+IQR_TO_STDEV = 1.35
+MAD_TO_STDEV = 1.4826
+
+
+def quantiles(values, qs, axis = -1):
+    values = np.asarray(values)
+    n = values.shape[axis]
+    idxs = [min(int(n * q), n - 1) for q in qs]
+    partitioned = np.partition(values, sorted(set(idxs)), axis=axis)
+    return [np.take(partitioned, i, axis=axis) for i in idxs]
+
+
+def median_and_iqr_stdev(values, axis = -1):
+    q25, q50, q75 = quantiles(values, [0.25, 0.5, 0.75], axis)
+    return q50, (q75 - q25) / IQR_TO_STDEV
+
+
+def median_and_mad_stdev(values, axis = -1):
+    values = np.asarray(values)
+    median = quantiles(values, [0.5], axis)[0]
+    mad = quantiles(np.abs(values - np.expand_dims(median, axis)), [0.5], axis)[0]
+    return median, MAD_TO_STDEV * mad
+
+
+def _rolling(values, window, stat, max_block_elements = 2**22):
+    # Apply `stat` (reducing the last axis) to a centered window around every sample.
+    # The series is padded by reflection (so a sample at the boundary is not repeated into
+    # its own baseline) and processed in blocks of samples whose windows hold at
+    # most `max_block_elements` values in total (np.partition copies the window view).
+    # The cost is O(n * window): every window is partitioned from scratch.
+    values = np.asarray(values, dtype=np.float64)
+    block_size = max(1, max_block_elements // window)
+    half = window // 2
+    padded = np.pad(values, (half, window - 1 - half), mode="reflect")
+    results = []
+    for start in range(0, len(values), block_size):
+        stop = min(start + block_size, len(values))
+        results.append(stat(sliding_window_view(padded[start:stop + window - 1], window)))
+    return [np.concatenate(r) for r in zip(*results)]
+
+
+def running_median(values, window):
+    # O(n * window) time, see _rolling
+    return _rolling(values, window, lambda w: quantiles(w, [0.5]))[0]
+
+
+def running_median_and_iqr_stdev(values, window):
+    return _rolling(values, window, median_and_iqr_stdev)
+
+
+def snr(values, window = None):
+    """
+    Signal-to-noise ratio of every sample, using the median and IQR-based standard deviation
+    of the whole series or, if `window` is given, of a centered window around each sample.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    if window is None or window >= len(values):
+        baseline, stdev = median_and_iqr_stdev(values)
+    else:
+        baseline, stdev = running_median_and_iqr_stdev(values, window)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return (values - baseline) / stdev
+
+
+def threshold_peaks(values, snr_threshold = 5, window = None):
+    return np.flatnonzero(snr(values, window) >= snr_threshold)
@@ -0,0 +1,24 @@
+import numpy as np
+from astropy.io import fits
+from concurrent.futures import ThreadPoolExecutor
+from convert_fits import convert_file, covert_to_new_format
+
+
+def test_header_only_primary(tmp_path):
+    primary = fits.PrimaryHDU()
+    primary.header['TIME'], primary.header['MILLITIM'] = 1, 0
+    image = fits.ImageHDU(np.arange(12, dtype=np.float32).reshape(3, 4))
+    image.header['TIME'], image.header['MILLITIM'] = 2, 500
+    fits.HDUList([primary, image]).writeto(tmp_path / "in.fits")
+
+    with fits.open(tmp_path / "in.fits") as blink_fits:
+        covert_to_new_format(blink_fits).writeto(tmp_path / "legacy.fits")
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        input_bytes, output_bytes, n_hdus = convert_file(tmp_path / "in.fits", tmp_path / "out.fits", executor)
+
+    assert (input_bytes, n_hdus) == (image.data.nbytes, 2)
+    assert (tmp_path / "out.fits").read_bytes() == (tmp_path / "legacy.fits").read_bytes()
+    with fits.open(tmp_path / "out.fits") as converted:
+        assert converted[1].data is None
+        assert np.array_equal(converted[2].data, image.data)
+        assert (converted[0].header['TIME'], converted[0].header['MILLITIM']) == (2, 500)
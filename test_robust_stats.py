@@ -0,0 +1,17 @@
+import numpy as np
+import pytest
+from robust_stats import threshold_peaks, running_median
+
+
+@pytest.mark.parametrize("pulse_idx", [0, 1, 500, 998, 999])
+def test_windowed_peaks_at_the_boundaries(pulse_idx):
+    values = np.random.default_rng(1).normal(0, 1, 1000)
+    values[pulse_idx] += 20
+    assert list(threshold_peaks(values, 5, window=51)) == [pulse_idx]
+    assert list(threshold_peaks(values, 5)) == [pulse_idx]
+
+
+def test_running_median_ignores_a_boundary_spike():
+    values = np.zeros(100)
+    values[0] = values[-1] = 1000
+    assert np.all(running_median(values, 11) == 0)
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+
+# Plan the staging of VCS observations from the ASVO archive to the cluster scratch space.
+# Selected target observations are paired with a calibrator (see parse_asvo.CalibratorIndex),
+# split into batches that fit the scratch quota (a calibrator shared by several targets of
+# a batch is downloaded once) and the download time of every batch is estimated from the
+# link bandwidth, the number of parallel streams and a fixed staging overhead per
+# observation. The plan is written as a JSON job manifest.
+
+import json
+import argparse
+from asvo import load_asvo_columns, columns_to_records
+from asvo_catalogue import ObservationCatalogue
+from parse_asvo import CalibratorIndex
+
+
+def pair_calibrators(targets, cal_index, policy = "after", max_gap = None):
+    # list of (target, calibrator or None)
+    cals = cal_index.find_many([t["obs_id"] for t in targets], [t["center_frequency_mhz"] for t in targets], policy, max_gap)
+    return list(zip(targets, cals))
+
+
+def transfer_time_s(sizes, bandwidth_bps, n_streams = 1, stream_bps = None, staging_s = 0):
+    """
+    Time to download files of the given sizes (bytes) over `n_streams` parallel streams
+    sharing `bandwidth_bps` (bits per second), each stream limited to `stream_bps`.
+    Every file pays `staging_s` seconds (archive recall, job start) before its transfer.
+    Files are started longest first on the stream that frees up first; the transfers in
+    progress share the link equally, so fewer active streams get more bandwidth each.
+    """
+    queue = sorted(sizes)
+    now = 0.0
+    # staging end times and remaining bits of the files on the streams
+    staging = [now + staging_s for _ in range(min(n_streams, len(queue)))]
+    remaining = [8 * queue.pop() for _ in staging]
+    while staging:
+        transferring = [i for i, ready in enumerate(staging) if ready <= now]
+        rate = bandwidth_bps / max(1, len(transferring))
+        if stream_bps is not None:
+            rate = min(rate, stream_bps)
+        # advance to the next staging end or transfer end
+        step = min([ready - now for ready in staging if ready > now] + [remaining[i] / rate for i in transferring])
+        now += step
+        for i in transferring:
+            remaining[i] -= step * rate
+        for i in reversed(range(len(staging))):
+            if staging[i] <= now and remaining[i] <= 1e-6 * rate:
+                if queue:
+                    staging[i], remaining[i] = now + staging_s, 8 * queue.pop()
+                else:
+                    del staging[i], remaining[i]
+    return now
+
+
+def plan_batches(pairs, quota_bytes, size_key = "total_archived_data_bytes"):
+    """
+    First-fit decreasing packing of (target, calibrator) pairs into batches of at most
+    `quota_bytes`. A calibrator already in a batch adds nothing to it. Pairs without
+    calibrator are skipped. Returns (batches, targets whose pair exceeds the quota).
+    """
+    def pair_bytes(pair):
+        return pair[0][size_key] + pair[1][size_key]
+
+    batches, oversized = [], []
+    for target, cal in sorted((p for p in pairs if p[1] is not None), key=pair_bytes, reverse=True):
+        if pair_bytes((target, cal)) > quota_bytes:
+            oversized.append(target)
+            continue
+        for batch in batches:
+            extra = target[size_key] + (0 if cal["obs_id"] in batch["calibrators"] else cal[size_key])
+            if batch["bytes"] + extra <= quota_bytes:
+                break
+        else:
+            batch = {"targets": {}, "calibrators": {}, "bytes": 0}
+            batches.append(batch)
+            extra = pair_bytes((target, cal))
+        batch["targets"][target["obs_id"]] = (target, cal["obs_id"])
+        batch["calibrators"][cal["obs_id"]] = cal
+        batch["bytes"] += extra
+    return batches, oversized
+
+
+def build_manifest(pairs, batches, oversized, bandwidth_bps, n_streams, stream_bps, staging_s, quota_bytes,
+                   size_key = "total_archived_data_bytes"):
+    jobs, total_s = [], 0.0
+    for i, batch in enumerate(batches):
+        sizes = [t[size_key] for t, _ in batch["targets"].values()] + [c[size_key] for c in batch["calibrators"].values()]
+        batch_s = transfer_time_s(sizes, bandwidth_bps, n_streams, stream_bps, staging_s)
+        total_s += batch_s
+        jobs.append({
+            "batch": i,
+            "bytes": int(batch["bytes"]),
+            "estimated_transfer_s": round(batch_s, 1),
+            "observations": [{"obs_id": int(obs_id), "calibrator": int(cal_id), "bytes": int(t[size_key]),
+                              "center_frequency_mhz": t["center_frequency_mhz"], "starttime_utc": t["starttime_utc"]}
+                             for obs_id, (t, cal_id) in sorted(batch["targets"].items())],
+            "calibrators": [{"obs_id": int(obs_id), "bytes": int(c[size_key])} for obs_id, c in sorted(batch["calibrators"].items())],
+        })
+    return {
+        "parameters": {"bandwidth_gbps": bandwidth_bps / 1e9, "streams": n_streams,
+                       "stream_gbps": None if stream_bps is None else stream_bps / 1e9,
+                       "staging_s": staging_s, "quota_tb": quota_bytes / 1000**4},
+        "total_bytes": int(sum(b["bytes"] for b in batches)),
+        "estimated_total_s": round(total_s, 1),
+        "batches": jobs,
+        "no_calibrator": sorted(int(t["obs_id"]) for t, cal in pairs if cal is None),
+        "over_quota": sorted(int(t["obs_id"]) for t in oversized),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--calibrators", type=str, default="data/cal_obs.xml", help="ASVO export of the calibrator observations.")
+    parser.add_argument("--project", type=str, default=None, help="Only plan the observations of this project.")
+    parser.add_argument("--min-duration", type=int, default=1200, help="Minimum duration of the targets (seconds).")
+    parser.add_argument("--min-freq", type=float, default=180, help="Minimum centre frequency of the targets (MHz).")
+    parser.add_argument("--policy", choices=["after", "before", "nearest"], default="after", help="Calibrator matching policy.")
+    parser.add_argument("--max-gap", type=int, default=None, help="Maximum time between target and calibrator (seconds).")
+    parser.add_argument("--bandwidth", type=float, default=10, help="Link bandwidth (Gbit/s).")
+    parser.add_argument("--streams", type=int, default=4, help="Number of parallel downloads.")
+    parser.add_argument("--stream-bandwidth", type=float, default=None, help="Maximum bandwidth of a single download (Gbit/s).")
+    parser.add_argument("--staging", type=float, default=0, help="Staging overhead per observation (seconds).")
+    parser.add_argument("--quota", type=float, required=True, help="Scratch quota per batch (TB).")
+    parser.add_argument("--output", type=str, default="transfer_manifest.json", help="Output JSON manifest.")
+    parser.add_argument("XML FILE", nargs='+', type=str, help="ASVO exports of the candidate target observations.")
+    args = vars(parser.parse_args())
+
+    catalogue = ObservationCatalogue.from_files(args["XML FILE"])
+    mask = (catalogue["duration"] >= args["min_duration"]) & (catalogue["center_frequency_mhz"] >= args["min_freq"])
+    conditions = {} if args["project"] is None else {"projectid": args["project"]}
+    targets = columns_to_records(catalogue.filter(mask, **conditions).columns)
+    cal_index = CalibratorIndex(columns_to_records(load_asvo_columns(args["calibrators"])))
+
+    stream_bps = None if args["stream_bandwidth"] is None else args["stream_bandwidth"] * 1e9
+    quota_bytes = args["quota"] * 1000**4
+    pairs = pair_calibrators(targets, cal_index, args["policy"], args["max_gap"])
+    batches, oversized = plan_batches(pairs, quota_bytes)
+    manifest = build_manifest(pairs, batches, oversized, args["bandwidth"] * 1e9, args["streams"], stream_bps,
+                              args["staging"], quota_bytes)
+    with open(args["output"], "w") as f:
+        json.dump(manifest, f, indent=2)
+
+    print(f"{len(targets)} targets, {len(manifest['no_calibrator'])} without calibrator, "
+          f"{len(manifest['over_quota'])} larger than the quota.")
+    for job in manifest["batches"]:
+        print(f"Batch {job['batch']:3}: {len(job['observations']):3} targets, {len(job['calibrators']):3} calibrators, "
+              f"{job['bytes'] / 1000**4:7.2f} TB, {job['estimated_transfer_s'] / 3600:6.2f} h")
+    print(f"Total: {manifest['total_bytes'] / 1000**4:.2f} TB, {manifest['estimated_total_s'] / 3600:.2f} h")